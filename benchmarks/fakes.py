@@ -0,0 +1,330 @@
+# benchmarks/fakes.py
+"""
+Offline stand-ins for every upstream client used in utils/, driven by the
+recorded fixtures in benchmarks/fixtures/ and an injectable latency per
+provider. install() swaps them into the already-imported utils modules.
+"""
+import os
+import json
+import math
+import time
+import random
+import threading
+from datetime import datetime, timedelta
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "search_fixtures.json")
+
+# Seconds per upstream call (before jitter). Rough production medians.
+DEFAULT_LATENCY = {
+    'gmaps': 0.12,          # find_place / place / distance_matrix
+    'reddit': 0.25,         # subreddit search / comment tree fetch
+    'weather': 0.15,        # One Call
+    'yelp': 0.20,           # business match / reviews
+    'gemini': 0.60,         # generate_content (full response)
+    'gemini_chunk': 0.05,   # per streamed chunk
+    'sentiment': 0.01,      # per review (fake NLP only)
+    'summarize': 0.30,      # per summary request (fake NLP only)
+}
+
+
+def load_fixtures(path=FIXTURES_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_latency(spec, scale=1.0):
+    """
+    Parses "gmaps=0.1,gemini=1.5" into a full latency dict (defaults for the
+    rest), multiplied by `scale`.
+    """
+    latency = dict(DEFAULT_LATENCY)
+    for item in filter(None, (spec or "").split(",")):
+        name, _, value = item.partition("=")
+        if name.strip() not in latency:
+            raise ValueError(f"Unknown latency provider: {name}")
+        latency[name.strip()] = float(value)
+    return {name: seconds * scale for name, seconds in latency.items()}
+
+
+class Latency:
+    """Sleeps for a provider's configured latency, with +/-20% jitter."""
+
+    def __init__(self, latency, seed=0):
+        self.latency = latency
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = {}
+
+    def wait(self, provider, multiplier=1):
+        with self._lock:
+            jitter = self._random.uniform(0.8, 1.2)
+            self.calls[provider] = self.calls.get(provider, 0) + 1
+        seconds = self.latency.get(provider, 0) * multiplier * jitter
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+# --- Google Maps ---
+
+class FakeGmaps:
+    def __init__(self, fixtures, latency):
+        self.latency = latency
+        self.places = fixtures['places']
+        self.reviews = fixtures['google_reviews']
+
+    def _find(self, text):
+        text = (text or "").lower()
+        for place in self.places:
+            if place['query'].lower() in text or text in place['name'].lower():
+                return place
+        return None
+
+    def find_place(self, input, input_type="textquery", fields=None):
+        self.latency.wait('gmaps')
+        place = self._find(input)
+        if place is None:
+            return {'status': 'ZERO_RESULTS', 'candidates': []}
+        return {'status': 'OK', 'candidates': [{
+            'place_id': place['place_id'],
+            'name': place['name'],
+            'formatted_address': place['formatted_address'],
+            'geometry': {'location': {'lat': place['lat'], 'lng': place['lng']}},
+        }]}
+
+    def place(self, place_id, fields=None):
+        self.latency.wait('gmaps')
+        place = next((p for p in self.places if p['place_id'] == place_id), None)
+        if place is None:
+            return {'status': 'NOT_FOUND'}
+        result = {field: place.get(field) for field in
+                  ("name", "formatted_address", "rating", "website", "formatted_phone_number")}
+        result['reviews'] = self.reviews
+        if fields == ["review"]:
+            result = {'reviews': self.reviews}
+        return {'status': 'OK', 'result': result}
+
+    def distance_matrix(self, origins, destinations, mode="driving", units="imperial"):
+        self.latency.wait('gmaps')
+        rows = []
+        for origin in origins:
+            elements = []
+            for destination in destinations:
+                meters = _haversine(origin['latitude'], origin['longitude'],
+                                    destination['latitude'], destination['longitude'])
+                minutes = max(1, int(meters / 400))  # ~24 km/h city driving
+                elements.append({
+                    'status': 'OK',
+                    'distance': {'text': f"{meters / 1609.344:.1f} mi", 'value': int(meters)},
+                    'duration': {'text': f"{minutes} mins", 'value': minutes * 60},
+                })
+            rows.append({'elements': elements})
+        return {'status': 'OK', 'rows': rows}
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin(math.radians(lat2 - lat1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+
+# --- Reddit (PRAW) ---
+
+class _FakeAuthor:
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class _FakeComment:
+    def __init__(self, body, index):
+        self.body = body
+        self.created_utc = 1714800000 + index * 3600
+        self.author = _FakeAuthor(f"redditor{index}")
+        self.replies = []
+
+
+class _FakeSubmission:
+    def __init__(self, comments, latency):
+        self._comments = comments
+        self._latency = latency
+        self._loaded = None
+
+    @property
+    def comments(self):
+        if self._loaded is None:
+            self._latency.wait('reddit')  # Comment tree fetch
+            self._loaded = [_FakeComment(body, i) for i, body in enumerate(self._comments)]
+        return self._loaded
+
+
+class _FakeSubreddit:
+    def __init__(self, name, fixtures, latency):
+        self.name = name
+        self._fixtures = fixtures
+        self._latency = latency
+
+    def search(self, query, limit=5):
+        self._latency.wait('reddit')
+        # Only the city and travel subreddits "know" about our fixture places
+        if self.name not in ("travel", "sanfrancisco", "pacifica", "bayarea"):
+            return []
+        return [_FakeSubmission(self._fixtures['reddit_comments'], self._latency) for _ in range(min(limit, 2))]
+
+
+class FakeReddit:
+    def __init__(self, fixtures, latency):
+        self._fixtures = fixtures
+        self._latency = latency
+
+    def subreddit(self, name):
+        return _FakeSubreddit(name, self._fixtures, self._latency)
+
+
+# --- OpenWeatherMap (pyowm) ---
+
+class _FakeDailyForecast:
+    def __init__(self, day, data):
+        self._timestamp = int(datetime(day.year, day.month, day.day, 12).timestamp())
+        self._temperature = data['temperature']
+        self.detailed_status = data['description']
+
+    def reference_time(self, timeformat='unix'):
+        return self._timestamp
+
+    def temperature(self, unit='fahrenheit'):
+        return {'day': self._temperature}
+
+
+class _FakeOneCall:
+    def __init__(self, forecast_daily):
+        self.forecast_daily = forecast_daily
+
+
+class FakeWeatherManager:
+    def __init__(self, fixtures, latency):
+        self._weather = fixtures['weather']
+        self._latency = latency
+
+    def one_call(self, lat, lon):
+        self._latency.wait('weather')
+        today = datetime.now()
+        return _FakeOneCall([
+            _FakeDailyForecast(today + timedelta(days=offset), self._weather[offset % len(self._weather)])
+            for offset in range(8)
+        ])
+
+
+# --- Gemini ---
+
+class _FakeGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiModel:
+    def __init__(self, fixtures, latency):
+        self._entities = fixtures['entities']
+        self._places = fixtures['places']
+        self._review = fixtures['gemini_review']
+        self._latency = latency
+
+    def _entities_for(self, prompt):
+        marker = "User Query: '"
+        start = prompt.index(marker) + len(marker)
+        query = prompt[start:prompt.index("'\n", start)]
+        if query in self._entities:
+            return self._entities[query]
+        lowered = query.lower()
+        return [place['query'] for place in self._places if place['query'].lower() in lowered]
+
+    def generate_content(self, prompt, stream=False, request_options=None, **kwargs):
+        if "Extract all distinct named places" in prompt:
+            self._latency.wait('gemini')
+            return _FakeGeminiResponse(json.dumps(self._entities_for(prompt)))
+        if not stream:
+            self._latency.wait('gemini')
+            return _FakeGeminiResponse(self._review)
+        return self._stream(self._review)
+
+    def _stream(self, text, chunk_size=40):
+        for start in range(0, len(text), chunk_size):
+            self._latency.wait('gemini_chunk')
+            yield _FakeGeminiResponse(text[start:start + chunk_size])
+
+
+# --- Yelp ---
+
+class _FakeHTTPResponse:
+    def __init__(self, payload):
+        self._payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._payload
+
+
+class FakeYelpSession:
+    def __init__(self, fixtures, latency):
+        self._reviews = fixtures['yelp_reviews']
+        self._latency = latency
+
+    def get(self, url, timeout=None, **kwargs):
+        self._latency.wait('yelp')
+        if "/businesses/matches" in url:
+            return _FakeHTTPResponse({'businesses': [{'id': 'fx-yelp-business'}]})
+        if url.rstrip("/").endswith("/reviews"):
+            return _FakeHTTPResponse({'reviews': self._reviews})
+        return _FakeHTTPResponse({})
+
+
+# --- NLP (optional: only when the real models are not wanted) ---
+
+_POSITIVE_WORDS = ("love", "great", "good", "best", "recommend", "beautiful", "friendly", "must")
+
+
+def make_fake_nlp(latency):
+    """
+    Returns (analyze_sentiment_batch, summarize_reviews_batch) stand-ins that
+    cost `sentiment` seconds per review and `summarize` seconds per request.
+    """
+    def analyze_sentiment_batch(texts, mini_batch_size=32):
+        latency.wait('sentiment', multiplier=len(texts))
+        return ['Positive' if any(word in (text or "").lower() for word in _POSITIVE_WORDS) else 'Negative'
+                for text in texts]
+
+    def summarize_reviews_batch(requests, max_length=130, min_length=30, mode=None, deadline=None):
+        latency.wait('summarize', multiplier=len(requests))
+        summaries = []
+        for reviews, sentiment_category in requests:
+            texts = [review['text'] for review in reviews
+                     if sentiment_category in (review.get('sentiment') or "")]
+            summaries.append(texts[0][:max_length] if texts else f"No {sentiment_category} reviews to summarize.")
+        return summaries
+
+    return analyze_sentiment_batch, summarize_reviews_batch
+
+
+def install(main_module, latency, fixtures=None, fake_nlp=True):
+    """
+    Replaces every upstream client used by utils/ with its fixture-backed
+    stand-in. Must be called after `main` has been imported.
+    """
+    from utils import api_utils, travel_utils, scraping_utils, weather_utils, gemini_utils, yelp_api_utils
+
+    fixtures = fixtures or load_fixtures()
+    gmaps = FakeGmaps(fixtures, latency)
+    api_utils.gmaps = gmaps
+    travel_utils.gmaps = gmaps
+    scraping_utils._new_reddit_client = lambda: FakeReddit(fixtures, latency)
+    weather_utils._weather_manager = FakeWeatherManager(fixtures, latency)
+    gemini_utils._model = FakeGeminiModel(fixtures, latency)
+    yelp_api_utils.session = FakeYelpSession(fixtures, latency)
+
+    if fake_nlp:
+        main_module.analyze_sentiment_batch, main_module.summarize_reviews_batch = make_fake_nlp(latency)
+    return fixtures
@@ -0,0 +1,166 @@
+# benchmarks/nlp_parity.py
+"""
+Parity and speed check for the NLP inference backends (NLP_BACKEND).
+
+Runs sentiment and summarization over a fixture corpus with a reference
+backend (fp32 PyTorch) and a candidate backend, then reports label agreement,
+summary similarity (unigram F1) and the inference speedup. Exits non-zero if
+the candidate falls below the agreement thresholds.
+
+Usage (from the repo root, models must be downloadable or cached):
+    python -m benchmarks.nlp_parity --backend quantized
+    python -m benchmarks.nlp_parity --backend onnx --repeat 5 --json parity.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import Counter
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "nlp_corpus.json")
+REVIEWS_PER_PLACE = 5
+
+POLARITY = {
+    'Highly Positive': 'Positive', 'Positive': 'Positive',
+    'Highly Negative': 'Negative', 'Negative': 'Negative',
+}
+
+
+def load_corpus():
+    """Review texts from the NLP corpus plus every review in the search fixtures."""
+    from benchmarks.fakes import load_fixtures
+
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        texts = list(json.load(f)['reviews'])
+    fixtures = load_fixtures()
+    texts += [review['text'] for review in fixtures['google_reviews']]
+    texts += list(fixtures['reddit_comments'])
+    texts += [review['text'] for review in fixtures['yelp_reviews']]
+    return texts
+
+
+def summary_requests(texts, labels):
+    """
+    Groups the corpus into fake places of REVIEWS_PER_PLACE reviews and asks
+    for a positive and a negative summary of each, like /search does.
+    """
+    requests = []
+    for start in range(0, len(texts), REVIEWS_PER_PLACE):
+        reviews = [{'text': text, 'sentiment': label}
+                   for text, label in zip(texts[start:start + REVIEWS_PER_PLACE], labels[start:start + REVIEWS_PER_PLACE])]
+        requests.append((reviews, "Positive"))
+        requests.append((reviews, "Negative"))
+    return requests
+
+
+def unigram_f1(a, b):
+    """ROUGE-1 style F1 between two strings."""
+    tokens_a, tokens_b = Counter(a.lower().split()), Counter(b.lower().split())
+    overlap = sum((tokens_a & tokens_b).values())
+    if not overlap:
+        return 1.0 if not tokens_a and not tokens_b else 0.0
+    precision = overlap / sum(tokens_a.values())
+    recall = overlap / sum(tokens_b.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def best_of(repeat, func):
+    """Runs func() `repeat` times. Returns (last result, fastest seconds)."""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def run_backend(backend, texts, repeat, requests=None):
+    """
+    Loads `backend`'s models and runs the corpus through them. Summaries use
+    `requests` if given (so every backend summarizes the same input),
+    otherwise requests built from this backend's own labels.
+    """
+    from utils import nlp_utils
+
+    start = time.perf_counter()
+    classifier = nlp_utils.load_classifier(backend)
+    summarizer = nlp_utils.load_summarizer(backend)
+    load_seconds = time.perf_counter() - start
+
+    labels, sentiment_seconds = best_of(repeat, lambda: nlp_utils.analyze_sentiment_batch(texts, classifier=classifier))
+    requests = requests or summary_requests(texts, labels)
+    # Always the model tier: automatic tier selection could fall back to
+    # extractive summaries, which would not test this backend's summarizer
+    summaries, summary_seconds = best_of(
+        repeat, lambda: nlp_utils.summarize_reviews_batch(requests, summarizer=summarizer, mode="abstractive"))
+    return {
+        'backend': backend,
+        'labels': labels,
+        'summaries': summaries,
+        'requests': requests,
+        'load_seconds': load_seconds,
+        'sentiment_seconds': sentiment_seconds,
+        'summary_seconds': summary_seconds,
+    }
+
+
+def compare(texts, reference, candidate):
+    labels = list(zip(reference['labels'], candidate['labels']))
+    similarities = [unigram_f1(a, b) for a, b in zip(reference['summaries'], candidate['summaries'])]
+    return {
+        'label_agreement': sum(a == b for a, b in labels) / len(labels),
+        'polarity_agreement': sum(POLARITY.get(a, a) == POLARITY.get(b, b) for a, b in labels) / len(labels),
+        'summary_similarity_mean': sum(similarities) / len(similarities),
+        'summary_similarity_min': min(similarities),
+        'sentiment_speedup': reference['sentiment_seconds'] / candidate['sentiment_seconds'],
+        'summary_speedup': reference['summary_seconds'] / candidate['summary_seconds'],
+        'label_mismatches': [
+            {'text': text, 'reference': a, 'candidate': b}
+            for text, (a, b) in zip(texts, labels) if a != b
+        ],
+    }
+
+
+def main(argv=None):
+    from utils.nlp_utils import NLP_BACKENDS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=NLP_BACKENDS, default="quantized", help="Candidate backend")
+    parser.add_argument("--reference", choices=NLP_BACKENDS, default="torch", help="Reference backend")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per backend (fastest is reported)")
+    parser.add_argument("--min-polarity-agreement", type=float, default=0.95,
+                        help="Fail if fewer labels agree on Positive/Negative")
+    parser.add_argument("--min-summary-similarity", type=float, default=0.6,
+                        help="Fail if mean summary unigram F1 is lower")
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    texts = load_corpus()
+    reference = run_backend(args.reference, texts, args.repeat)
+    candidate = run_backend(args.backend, texts, args.repeat, requests=reference['requests'])
+    report = compare(texts, reference, candidate)
+
+    print(f"{len(texts)} reviews, {len(reference['requests'])} summary requests, best of {args.repeat}")
+    print(f"{'':<22}{args.reference:>12}{args.backend:>12}")
+    for key, label in (('load_seconds', 'load s'), ('sentiment_seconds', 'sentiment s'), ('summary_seconds', 'summaries s')):
+        print(f"{label:<22}{reference[key]:>12.2f}{candidate[key]:>12.2f}")
+    print(f"sentiment speedup     {report['sentiment_speedup']:.2f}x")
+    print(f"summary speedup       {report['summary_speedup']:.2f}x")
+    print(f"label agreement       {report['label_agreement']:.1%} (polarity {report['polarity_agreement']:.1%})")
+    print(f"summary similarity    mean {report['summary_similarity_mean']:.2f}, min {report['summary_similarity_min']:.2f}")
+    for mismatch in report['label_mismatches']:
+        print(f"  {mismatch['reference']} -> {mismatch['candidate']}: {mismatch['text'][:70]}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'args': vars(args), **report}, f, indent=2)
+
+    passed = (report['polarity_agreement'] >= args.min_polarity_agreement
+              and report['summary_similarity_mean'] >= args.min_summary_similarity)
+    print("PASS" if passed else "FAIL")
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+# benchmarks/search_bench.py
+"""
+Offline latency benchmark for the /search pipeline.
+
+Drives main.app through the Flask test client with every upstream service
+replaced by fixture-backed stand-ins (benchmarks/fakes.py), then reports
+p50/p95/p99 latency and throughput end to end and per stage.
+
+Usage (from the repo root, no network needed):
+    python -m benchmarks.search_bench --requests 60 --concurrency 4
+    python -m benchmarks.search_bench --endpoint /search/stream --nlp real
+    python -m benchmarks.search_bench --latency gemini=2.0,reddit=0.5 --cold
+    python -m benchmarks.search_bench --json bench_output.json
+"""
+import os
+import sys
+import json
+import time
+import inspect
+import logging
+import argparse
+import tempfile
+import functools
+import contextlib
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+# The utils modules read these at import time; dummy values keep them from
+# refusing to start. Nothing is ever sent to the real services.
+BENCH_ENV = {
+    "GOOGLE_MAPS_API_KEY": "AIzaBenchmarkOfflineKey",
+    "OPENWEATHERMAP_API_KEY": "benchmark",
+    "YELP_API_KEY": "benchmark",
+    "GEMINI_API_KEY": "benchmark",
+    "REDDIT_CLIENT_ID": "benchmark",
+    "REDDIT_CLIENT_SECRET": "benchmark",
+    "REDDIT_USER_AGENT": "weekend-fun-rater-benchmark",
+    "NLP_WARM_UP": "0",
+    # Measure the pipeline, not the full-response cache (set RESPONSE_CACHE=1 to include it)
+    "RESPONSE_CACHE": "0",
+}
+
+# Stage name -> function name in main.py. Wrapped with timers after the fakes
+# are installed; names missing from main are skipped.
+STAGES = [
+    ("entity_extraction", "extract_entities_with_gemini"),
+    ("place_lookup", "get_place_details"),
+    ("reddit", "scrape_reddit_reviews"),
+    ("yelp", "get_yelp_reviews"),
+    ("weather", "get_weekend_weather"),
+    ("sentiment", "analyze_sentiment_batch"),
+    ("summarization", "summarize_reviews_batch"),
+    ("travel", "get_travel_matrix"),
+    ("review_generation", "generate_gemini_review"),
+    ("review_generation", "generate_gemini_review_stream"),
+]
+
+
+class Timings:
+    """Thread-safe collection of durations per name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def timed(timings, stage, func):
+    """Wraps a function (or generator function) to record its duration."""
+    if getattr(func, "__wrapped_stage__", None):
+        return func
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                yield from func(*args, **kwargs)
+            finally:
+                timings.record(stage, time.perf_counter() - start)
+        generator_wrapper.__wrapped_stage__ = stage
+        return generator_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings.record(stage, time.perf_counter() - start)
+    wrapper.__wrapped_stage__ = stage
+    return wrapper
+
+
+def instrument_stages(main_module, timings):
+    for stage, name in STAGES:
+        func = getattr(main_module, name, None)
+        if func is not None:
+            setattr(main_module, name, timed(timings, stage, func))
+
+
+def reset_caches():
+    """
+    Empties every in-process cache and the SQLite store, so the next request
+    runs cold.
+    """
+    from utils import entity_utils, travel_utils, nlp_utils, yelp_api_utils, weather_utils, db_utils
+
+    for cache in (entity_utils._entity_cache, travel_utils._travel_cache,
+                  nlp_utils._sentiment_cache, yelp_api_utils._match_cache):
+        cache.clear()
+    with weather_utils._cache_lock:
+        weather_utils._forecast_cache.clear()
+
+    conn = db_utils.get_connection()
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    for table in tables:
+        conn.execute(f"DELETE FROM {table}")
+    conn.commit()
+
+
+def run_request(app, endpoint, query):
+    """
+    Sends one request. Returns (status, seconds, seconds_to_first_byte).
+    """
+    client = app.test_client()
+    start = time.perf_counter()
+    response = client.post(endpoint, json={'query': query}, buffered=False)
+    first_byte = None
+    for chunk in response.response:
+        if first_byte is None and chunk:
+            first_byte = time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+    response.close()
+    return response.status_code, elapsed, first_byte if first_byte is not None else elapsed
+
+
+def run_load(app, endpoint, queries, total, concurrency, cold):
+    """
+    Sends `total` requests cycling through `queries` from `concurrency`
+    threads. Returns (results, wall_seconds).
+    """
+    query_cycle = itertools.cycle(queries)
+    lock = threading.Lock()
+
+    def next_query():
+        with lock:
+            return next(query_cycle)
+
+    def one(_):
+        if cold:
+            reset_caches()
+        return run_request(app, endpoint, next_query())
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    return results, time.perf_counter() - start
+
+
+def summarize(name, values, wall_seconds):
+    return {
+        'name': name,
+        'count': len(values),
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'mean_ms': (sum(values) / len(values) * 1000) if values else float("nan"),
+        'per_second': len(values) / wall_seconds if wall_seconds else float("nan"),
+    }
+
+
+def print_report(rows, header):
+    print(header)
+    print(f"{'stage':<22}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'per s':>9}")
+    for row in rows:
+        print(f"{row['name']:<22}{row['count']:>7}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row['p99_ms']:>10.1f}{row['mean_ms']:>10.1f}{row['per_second']:>9.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", default="/search", help="/search or /search/stream")
+    parser.add_argument("--requests", type=int, default=30, help="Measured requests")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent clients")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured warm-up requests")
+    parser.add_argument("--latency", default="", help="Per-provider latency overrides, e.g. gemini=1.0,reddit=0.4")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiply every injected latency")
+    parser.add_argument("--nlp", choices=("fake", "real"), default="fake",
+                        help="'real' runs the actual Flair/transformers models (must be cached locally)")
+    parser.add_argument("--cold", action="store_true", help="Clear all caches before every request")
+    parser.add_argument("--query", action="append", help="Query to send (repeatable); defaults to the fixtures")
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's own DEBUG output")
+    args = parser.parse_args(argv)
+
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+    os.environ["PLACES_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="wfr-bench-"), "bench.db")
+    if args.nlp == "real":
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")  # Never download during a benchmark
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    from benchmarks import fakes
+    import main as main_module
+
+    latency = fakes.Latency(fakes.parse_latency(args.latency, args.latency_scale))
+    fixtures = fakes.install(main_module, latency, fake_nlp=(args.nlp == "fake"))
+    if args.nlp == "real":
+        from utils import nlp_utils
+        nlp_utils.warm_up()  # Load models up front so they aren't counted in request latency
+
+    timings = Timings()
+    instrument_stages(main_module, timings)
+    queries = args.query or fixtures['queries']
+    app = main_module.app
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+
+    app_output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with app_output:
+        if args.warmup and not args.cold:
+            run_load(app, args.endpoint, queries, args.warmup, 1, cold=False)
+            timings.samples.clear()
+            latency.calls.clear()
+
+        results, wall_seconds = run_load(app, args.endpoint, queries, args.requests, args.concurrency, args.cold)
+
+    errors = sum(1 for status, _, _ in results if status != 200)
+    rows = [summarize("end_to_end", [elapsed for _, elapsed, _ in results], wall_seconds)]
+    if args.endpoint.endswith("/stream"):
+        rows.append(summarize("first_byte", [first for _, _, first in results], wall_seconds))
+    seen = []
+    for stage, _ in STAGES:
+        if stage not in seen and stage in timings.samples:
+            seen.append(stage)
+            rows.append(summarize(stage, timings.samples[stage], wall_seconds))
+
+    print_report(rows, f"{args.endpoint}: {args.requests} requests, concurrency {args.concurrency}, "
+                       f"nlp={args.nlp}{', cold' if args.cold else ''}, {wall_seconds:.2f}s wall, {errors} errors")
+    print(f"upstream calls: {json.dumps(latency.calls, sort_keys=True)}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'args': vars(args), 'wall_seconds': wall_seconds, 'errors': errors,
+                       'upstream_calls': latency.calls, 'stages': rows}, f, indent=2)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
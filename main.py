@@ -1,98 +1,886 @@
 # main.py (formerly app.py)
-from flask import Flask, request, jsonify, render_template
+import os
+import json
+import time
+import queue
+import hashlib
+import logging
+import threading
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context, g
 from utils.api_utils import get_place_details
 from utils.scraping_utils import scrape_reddit_reviews
-from utils.weather_utils import get_weekend_weather
-from utils.gemini_utils import generate_gemini_review
+from utils.yelp_api_utils import get_yelp_reviews
+from utils.weather_utils import get_weekend_weather, weekend_dates, weekend_window_end
+from utils.gemini_utils import generate_gemini_review, generate_gemini_review_stream, GEMINI_REQUESTS_PER_SECOND
 from utils.entity_utils import extract_entities_with_gemini
-from utils.travel_utils import get_travel_info
-from utils.nlp_utils import analyze_sentiment, summarize_reviews
+from utils.travel_utils import get_travel_matrix
+from utils.nlp_utils import start_warm_up, get_cached_sentiments, cache_sentiments, SUMMARY_MODES
+from utils import db_utils, metrics_utils, nlp_utils, inference_utils
+from utils.deadline_utils import Budget, time_left, expired
+from utils.inference_utils import INFERENCE_SOCKET, InferenceError
 
+# The NLP backend, picked here once. With INFERENCE_SOCKET set, the models
+# live in the shared inference server (python -m utils.inference_utils) and
+# this worker only holds the caches. The module-level names are what the
+# benchmark fakes and stage timers patch.
+nlp = inference_utils if INFERENCE_SOCKET else nlp_utils
+analyze_sentiment_batch = nlp.analyze_sentiment_batch
+summarize_reviews_batch = nlp.summarize_reviews_batch
+models_ready = nlp.models_ready
+models_status = nlp.models_status
+
+# Level-gated logging instead of print(): DEBUG output (and its formatting
+# cost) is skipped unless LOG_LEVEL=DEBUG.
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Load the NLP models in the background so the worker can answer health checks
+# (and serve "/") while torch, flair and transformers are still importing.
+# Set NLP_WARM_UP=0 to skip this and load the models on first use instead.
+if os.environ.get("NLP_WARM_UP", "1") != "0" and not INFERENCE_SOCKET:
+    start_warm_up()
+
+# Bounded thread pools for the per-entity network fan-out. Entities resolve on
+# ENTITY_POOL; inside each entity the weather and Yelp lookups overlap with
+# Reddit review gathering on STAGE_POOL (a separate pool, so entity tasks never wait on a
+# queue they are themselves filling). SEARCH_MAX_WORKERS=1 runs serially.
+SEARCH_MAX_WORKERS = int(os.environ.get("SEARCH_MAX_WORKERS", "4"))
+ENTITY_POOL = ThreadPoolExecutor(max_workers=max(SEARCH_MAX_WORKERS, 1), thread_name_prefix="entity")
+STAGE_POOL = ThreadPoolExecutor(max_workers=max(SEARCH_MAX_WORKERS, 1), thread_name_prefix="stage")
+# Sentiment runs here when a request has a deadline, so the request can stop
+# waiting for it (the labels still land in the cache for the next request)
+INFERENCE_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="inference")
+
+# End-to-end latency budget for /search and /search/stream, overridable per
+# request with "budget_seconds". Stage deadlines are cumulative fractions of
+# the budget: a stage that misses its deadline is cut off and flagged as late,
+# and the response carries whatever finished.
+SEARCH_BUDGET_SECONDS = float(os.environ.get("SEARCH_BUDGET_SECONDS", "20"))
+SEARCH_MAX_BUDGET_SECONDS = float(os.environ.get("SEARCH_MAX_BUDGET_SECONDS", "60"))
+SEARCH_STAGE_SPLITS = [
+    ("entities", 0.15),   # Entity extraction (Gemini)
+    ("gather", 0.55),     # Places, Reddit, Yelp, weather
+    ("inference", 0.75),  # Sentiment and summaries
+    ("review", 1.0),      # Gemini trip review
+]
+# Nothing runs without the entities, so a slow extraction may borrow time
+# planned for later stages as long as it leaves them this share of the budget
+SEARCH_STAGE_RESERVES = {"entities": float(os.environ.get("SEARCH_ENTITIES_RESERVE", "0.5"))}
+# Entity tasks cut their own slow sections at the gather deadline; give them
+# this long to hand back what they have before dropping the whole entity.
+SEARCH_STAGE_GRACE_SECONDS = 0.5
+
+# Full /search response cache, keyed by the resolved place_ids and the target
+# weekend, shared by all workers through the SQLite store. A response is fresh
+# for RESPONSE_CACHE_SOFT_TTL seconds; after that it is still served at once
+# while a background refresh rebuilds it, until the forecast window moves
+# (weather_utils.weekend_window_end()). Set RESPONSE_CACHE=0 to disable.
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_SOFT_TTL = int(os.environ.get("RESPONSE_CACHE_SOFT_TTL", "3600"))
+REFRESH_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="refresh")
+_refreshing = set()  # Cache keys with a refresh queued or running
+_refreshing_lock = threading.Lock()
+
+# /search/batch: many plans per request. Entity extraction, place lookups,
+# place gathering and the per-plan reviews fan out on BATCH_POOL, and the
+# gathered places' weather/Yelp stages on BATCH_STAGE_POOL, so a large batch
+# never queues ahead of interactive /search work on ENTITY_POOL/STAGE_POOL.
+# Each distinct place is gathered once for the whole batch.
+SEARCH_BATCH_MAX_QUERIES = int(os.environ.get("SEARCH_BATCH_MAX_QUERIES", "500"))
+SEARCH_BATCH_BUDGET_SECONDS = float(os.environ.get("SEARCH_BATCH_BUDGET_SECONDS", "120"))
+SEARCH_BATCH_MAX_BUDGET_SECONDS = float(os.environ.get("SEARCH_BATCH_MAX_BUDGET_SECONDS", "600"))
+SEARCH_BATCH_WORKERS = int(os.environ.get("SEARCH_BATCH_WORKERS", "8"))
+# Every plan costs about as many Gemini calls for extraction as for its
+# review, so batches split their budget between the two evenly. Without an
+# explicit "budget_seconds", the budget grows with the distinct plans at the
+# Gemini rate limit (with some headroom), between the default and the maximum.
+SEARCH_BATCH_STAGE_SPLITS = [
+    ("entities", 0.4),
+    ("gather", 0.5),
+    ("inference", 0.6),
+    ("review", 1.0),
+]
+SEARCH_BATCH_STAGE_RESERVES = {"entities": 0.5}
+SEARCH_BATCH_BUDGET_HEADROOM = 1.25
+BATCH_POOL = ThreadPoolExecutor(max_workers=SEARCH_BATCH_WORKERS, thread_name_prefix="batch")
+BATCH_STAGE_POOL = ThreadPoolExecutor(max_workers=SEARCH_BATCH_WORKERS, thread_name_prefix="batch-stage")
+
+
+def get_prefetched_entity(entity):
+    """
+    The record prefetch.py stored for the place `entity` resolves to this
+    weekend, or None: {'entity': entity dict with sentiment and summaries,
+    'place': the 'place' stage payload}.
+    """
+    place_id = db_utils.get_place_id_for_query(entity)
+    if place_id is None:
+        return None
+    record = db_utils.get_prefetched_place(place_id, weekend_dates()[0])
+    metrics_utils.record_cache("prefetch", hit=record is not None)
+    return record
+
+
+def gather_entity_data(entity, on_stage=None, deadline=None, use_prefetched=True, record_hit=True,
+                       stage_pool=None):
+    """
+    Looks up one entity's place details, reviews (Google, Reddit, Yelp) and
+    weekend weather.
+    Returns the entity dict (without sentiment/summaries), or None if the
+    place could not be found. Sections still missing at `deadline` are left
+    empty and listed in the dict's 'late'.
+
+    If the place was prefetched for this weekend, the stored dict is returned
+    instead, already labeled and summarized. The prefetch job itself passes
+    use_prefetched=False and record_hit=False (so it does not count towards
+    the place's popularity).
+
+    If `on_stage` is given it is called as on_stage(stage, payload) as soon as
+    the 'place' and 'weather' stages finish (used by /search/stream).
+    Weather and Yelp run on `stage_pool` (default STAGE_POOL).
+    """
+    stage_pool = stage_pool or STAGE_POOL
+    record = get_prefetched_entity(entity) if use_prefetched else None
+    if record is not None:
+        # Places prefetched before the entity dict carried the place fields
+        entity_data = {**record['place'], **record['entity']}
+        if record_hit:
+            db_utils.record_place_hit(entity_data['place_id'], entity)
+        if on_stage:
+            on_stage('place', record['place'])
+            on_stage('weather', entity_data['weather'])
+        return entity_data
+
+    place_info = get_place_details(entity)
+    logger.debug("Google Places info for %s: %s", entity, place_info and place_info.get('place_id'))
+
+    if not place_info:
+        logger.info("Could not retrieve place information for %s", entity)
+        if on_stage:
+            on_stage('place', None)
+        return None
+
+    latitude = place_info['geometry']['location']['lat']
+    longitude = place_info['geometry']['location']['lng']
+    if record_hit and place_info.get('place_id'):
+        db_utils.record_place_hit(place_info['place_id'], entity)
+    place = {
+        'name': place_info['name'],
+        'formatted_address': place_info.get('formatted_address'),
+        'rating': place_info.get('rating'),
+        'website': place_info.get('website'),
+        'latitude': latitude,
+        'longitude': longitude
+    }
+    if on_stage:
+        on_stage('place', place)
+
+    # Weather and Yelp only need the place, so fetch them while we gather
+    # Reddit reviews on this thread
+    yelp_args = (place_info['name'], place_info['formatted_address'], latitude, longitude, place_info.get('place_id'))
+
+    def fetch_weather():
+        weather_data = get_weekend_weather(latitude, longitude)
+        logger.debug("Weather data for %s: %s", entity, weather_data)
+        if on_stage:
+            on_stage('weather', weather_data)  # Report as soon as it is ready
+        return weather_data
+
+    if SEARCH_MAX_WORKERS > 1:
+        weather_future = stage_pool.submit(fetch_weather)
+        yelp_future = stage_pool.submit(get_yelp_reviews, *yelp_args, deadline=deadline)
+    else:
+        weather_future = yelp_future = None
+
+    late = []
+    reddit_reviews = scrape_reddit_reviews(place_info['name'], place_info['formatted_address'], deadline=deadline)
+    if expired(deadline):
+        late.append('reddit')  # Cut off, may be incomplete
+    logger.debug("Reddit reviews for %s: %d", entity, len(reddit_reviews))
+
+    yelp_reviews = _stage_result(yelp_future, lambda: get_yelp_reviews(*yelp_args, deadline=deadline), deadline)
+    if yelp_reviews is None:
+        late.append('yelp')
+        yelp_reviews = []
+    logger.debug("Yelp reviews for %s: %d", entity, len(yelp_reviews))
+
+    all_reviews = []
+    google_reviews = place_info.get('reviews', [])
+    for review in google_reviews:
+        all_reviews.append(review.copy())
+    for review in reddit_reviews:
+        all_reviews.append(review.copy())
+    for review in yelp_reviews:
+        all_reviews.append(review.copy())
+
+    weather_data = _stage_result(weather_future, fetch_weather, deadline)
+    if weather_data is None and expired(deadline):
+        late.append('weather')
+
+    return {
+        **place,  # Everything the 'place' stage reported, so cached plans can replay it
+        'place_id': place_info.get('place_id'),
+        'reviews': all_reviews,  # Keep all reviews for display
+        'weather': weather_data,
+        'late': late
+    }
+
+
+def _stage_result(future, run_inline, deadline):
+    """
+    Result of a stage running on `future` (or of run_inline() when the stage
+    was not offloaded), or None if it misses `deadline`. A missed stage that
+    has not started yet is cancelled; running stages get the deadline too,
+    and stop early on their own.
+    """
+    if future is None:
+        return None if expired(deadline) else run_inline()
+    try:
+        return future.result(timeout=time_left(deadline))
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        return None
+
+
+def gather_entities_data(entities, deadline=None, record_hits=True, pool=None, stage_pool=None):
+    """
+    Runs gather_entity_data for every entity, concurrently on `pool`
+    (default ENTITY_POOL) when SEARCH_MAX_WORKERS > 1. Keeps the order of
+    `entities` and skips entities whose place could not be found.
+
+    Returns (entities_data, late_entities): entities still unresolved at
+    `deadline` are left out and named in late_entities; those not started
+    by then are cancelled.
+    """
+    if SEARCH_MAX_WORKERS > 1 and len(entities) > 1:
+        futures = [(pool or ENTITY_POOL).submit(gather_entity_data, entity, None, deadline,
+                                                record_hit=record_hits, stage_pool=stage_pool)
+                   for entity in entities]
+        wait_until = None if deadline is None else deadline + SEARCH_STAGE_GRACE_SECONDS
+        results = [_stage_result(future, None, wait_until) for future in futures]
+    else:
+        results = [None if expired(deadline) else gather_entity_data(entity, deadline=deadline, record_hit=record_hits,
+                                                                  stage_pool=stage_pool)
+                   for entity in entities]
+    late_entities = [entity for entity, entity_data in zip(entities, results)
+                     if entity_data is None and expired(deadline)]
+    return [entity_data for entity_data in results if entity_data], late_entities
+
+
+# With a deadline, sentiment runs in chunks of this many texts so a late run
+# stops at the deadline (the chunks done so far are still cached)
+SENTIMENT_CHUNK_SIZE = 64
+
+
+def _label_and_cache(texts, deadline=None):
+    if deadline is None:
+        sentiments = analyze_sentiment_batch(texts)
+        cache_sentiments(texts, sentiments)
+        return sentiments
+    sentiments = []
+    for start in range(0, len(texts), SENTIMENT_CHUNK_SIZE):
+        if expired(deadline):
+            return None
+        chunk = texts[start:start + SENTIMENT_CHUNK_SIZE]
+        chunk_sentiments = analyze_sentiment_batch(chunk)
+        cache_sentiments(chunk, chunk_sentiments)
+        sentiments.extend(chunk_sentiments)
+    return sentiments
+
+
+def label_sentiments(entities_data, deadline=None):
+    """
+    Adds a 'sentiment' to every review of every entity that has none yet
+    (prefetched entities come labeled). Cached labels are reused; only the
+    misses go through the model, in one batched pass.
+
+    Returns False if the model missed `deadline` or the inference server
+    could not be reached; those reviews keep a None sentiment.
+    """
+    request_reviews = [review for entity_data in entities_data for review in entity_data['reviews']
+                       if review.get('sentiment') is None]
+    texts = [review['text'] for review in request_reviews]
+    sentiments = get_cached_sentiments(texts)
+
+    on_time = True
+    miss_indexes = [i for i, sentiment in enumerate(sentiments) if sentiment is None]
+    if miss_indexes:
+        miss_texts = [texts[i] for i in miss_indexes]
+        try:
+            if deadline is None:
+                miss_sentiments = _label_and_cache(miss_texts)
+            else:
+                miss_sentiments = _stage_result(INFERENCE_POOL.submit(_label_and_cache, miss_texts, deadline),
+                                                None, deadline)
+        except InferenceError as e:
+            logger.error("Sentiment analysis unavailable: %s", e)
+            miss_sentiments = None
+        if miss_sentiments is None:
+            logger.info("Sentiment analysis missed its deadline (%d reviews)", len(miss_texts))
+            on_time = False
+        else:
+            for i, sentiment in zip(miss_indexes, miss_sentiments):
+                sentiments[i] = sentiment
+    logger.debug("Sentiment cache hits: %d/%d", len(texts) - len(miss_indexes), len(texts))
+
+    for review, sentiment in zip(request_reviews, sentiments):
+        review['sentiment'] = sentiment
+    return on_time
+
+
+def summarize_entities(entities_data, mode=None, deadline=None):
+    """
+    Adds the positive and negative review summaries to every entity dict
+    that has none yet (prefetched entities keep theirs), using one batched
+    summarization pass for the whole request. `mode` picks the summary tier
+    (see nlp_utils.SUMMARY_MODE); in "auto" mode a close `deadline` switches
+    to extractive summaries.
+    """
+    entities_data = [entity_data for entity_data in entities_data if 'positive_summary' not in entity_data]
+    if not entities_data:
+        return
+    requests = []
+    for entity_data in entities_data:
+        requests.append((entity_data['reviews'], "Positive"))
+        requests.append((entity_data['reviews'], "Negative"))
+    summaries = summarize_reviews_batch(requests, mode=mode, deadline=deadline)
+    for i, entity_data in enumerate(entities_data):
+        entity_data['positive_summary'] = summaries[2 * i]
+        entity_data['negative_summary'] = summaries[2 * i + 1]
+
+
+def get_plan_travel(entities_data):
+    """
+    Travel data for the plan: (travel_info, travel_matrix).
+
+    travel_matrix covers every pair of entities (matrix[i][j] is the leg from
+    entity i to entity j). travel_info is the first-to-second leg, kept for
+    clients that only show a single leg.
+    """
+    if len(entities_data) < 2:
+        return None, None
+    locations = [(entity_data['latitude'], entity_data['longitude']) for entity_data in entities_data]
+    travel_matrix = get_travel_matrix(locations)
+    travel_info = travel_matrix[0][1]
+    logger.debug("Travel matrix: %s", travel_matrix)
+    return travel_info, travel_matrix
+
+
+def _search_budget(data, default=SEARCH_BUDGET_SECONDS, maximum=SEARCH_MAX_BUDGET_SECONDS,
+                   splits=SEARCH_STAGE_SPLITS, reserves=SEARCH_STAGE_RESERVES):
+    """
+    The request's latency budget: "budget_seconds" from the body (capped at
+    `maximum`) or `default`. Raises ValueError if it is not a positive number.
+    """
+    seconds = data.get('budget_seconds', default)
+    if isinstance(seconds, bool) or not isinstance(seconds, (int, float)) or seconds <= 0:
+        raise ValueError("budget_seconds must be a positive number")
+    return Budget(min(float(seconds), maximum), splits, reserves)
+
+
+def _batch_budget_seconds(queries):
+    """Default budget for a batch: two Gemini calls per distinct plan at the Gemini rate limit."""
+    gemini_seconds = 2 * len(set(queries)) / GEMINI_REQUESTS_PER_SECOND
+    return min(max(SEARCH_BATCH_BUDGET_SECONDS, gemini_seconds * SEARCH_BATCH_BUDGET_HEADROOM),
+               SEARCH_BATCH_MAX_BUDGET_SECONDS)
+
+
+def _late_report(entities_data, late_entities, sentiment_on_time, review_late):
+    """
+    What missed its deadline, e.g. {'entities': ['Mori Point'], 'sections':
+    {'Zuni Cafe': ['reddit']}, 'gemini_review': True}. Empty if nothing did.
+    """
+    late = {}
+    if late_entities:
+        late['entities'] = late_entities
+    sections = {entity_data['name']: entity_data['late'] for entity_data in entities_data if entity_data['late']}
+    if sections:
+        late['sections'] = sections
+    if not sentiment_on_time:
+        late['sentiment'] = True
+    if review_late:
+        late['gemini_review'] = True
+    return late
+
+
+def build_search_response(entities, summary_mode, budget, record_hits=True):
+    """
+    Runs the /search pipeline for already extracted entities and returns the
+    response dict.
+    """
+    entities_data, late_entities = gather_entities_data(entities, deadline=budget.deadline('gather'),
+                                                        record_hits=record_hits)
+
+    # Run sentiment for every review of every entity in one batched pass
+    sentiment_on_time = label_sentiments(entities_data, deadline=budget.deadline('inference'))
+
+    summarize_entities(entities_data, mode=summary_mode, deadline=budget.deadline('inference'))
+
+    return finish_plan(entities_data, late_entities, sentiment_on_time, budget)
+
+
+def finish_plan(entities_data, late_entities, sentiment_on_time, budget):
+    """
+    Adds travel and the Gemini review to a plan's labeled and summarized
+    entities and returns the response dict.
+    """
+    travel_info, travel_matrix = get_plan_travel(entities_data)
+
+    gemini_review = generate_gemini_review(entities_data, travel_info, travel_matrix,
+                                           deadline=budget.deadline('review'))
+    logger.debug("Gemini review: %d chars", len(gemini_review or ""))
+    review_late = gemini_review is None and expired(budget.deadline('review'))
+
+    late = _late_report(entities_data, late_entities, sentiment_on_time, review_late)
+    if late:
+        logger.info("Partial /search response after %.1fs: %s", budget.elapsed(), late)
+    return {
+        'entities': entities_data,
+        'travel_info': travel_info,
+        'travel_matrix': travel_matrix,
+        'gemini_review': gemini_review,
+        'partial': bool(late),
+        'late': late
+    }
+
+
+def response_cache_key(place_ids, summary_mode=None):
+    """Cache key for a plan: its places in order, the target weekend and the summary tier."""
+    saturday, sunday = weekend_dates()
+    # v2: entities carry the place stage fields (address, rating, website)
+    raw = json.dumps(["v2", list(place_ids), saturday, sunday, summary_mode or ""])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_cached_response(entities, summary_mode=None):
+    """
+    Looks up a cached response for the entities, if every one of them
+    resolved to a place recently. Returns (key, response, created_at); the
+    response is None on a miss, and the key is None if it cannot be known
+    before running the pipeline.
+    """
+    place_ids = [db_utils.get_place_id_for_query(entity) for entity in entities]
+    if None in place_ids:
+        return None, None, None
+    key = response_cache_key(place_ids, summary_mode)
+    cached = db_utils.get_cached_response(key)
+    metrics_utils.record_cache("response", hit=cached is not None)
+    if cached is None:
+        return key, None, None
+    for entity, place_id in zip(entities, place_ids):
+        db_utils.record_place_hit(place_id, entity)  # Keep popular plans in the prefetch set
+    return (key,) + cached
+
+
+def cache_response(entities, response_data, summary_mode=None):
+    """
+    Stores a complete response until the forecast window moves. Partial
+    responses, and plans where some place was not found, are not cached.
+    """
+    entities_data = response_data['entities']
+    if response_data['partial'] or len(entities_data) != len(entities):
+        return
+    key = response_cache_key([entity_data['place_id'] for entity_data in entities_data], summary_mode)
+    db_utils.save_cached_response(key, response_data, weekend_window_end())
+
+
+def _refresh_cached_response(key, entities, summary_mode):
+    try:
+        # Nobody is waiting on a refresh, so give it the largest budget
+        budget = Budget(SEARCH_MAX_BUDGET_SECONDS, SEARCH_STAGE_SPLITS)
+        # The stale hit that triggered this was already counted
+        response_data = build_search_response(entities, summary_mode, budget, record_hits=False)
+        cache_response(entities, response_data, summary_mode)
+        logger.debug("Refreshed cached response for %s", entities)
+    except Exception:
+        logger.exception("Error refreshing cached response for %s", entities)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+
+def schedule_refresh(key, entities, summary_mode=None):
+    """Rebuilds a stale cached response in the background, once per key."""
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    REFRESH_POOL.submit(_refresh_cached_response, key, entities, summary_mode)
+
+
+def _map_until(func, items, deadline):
+    """
+    Runs func(item) for every item on BATCH_POOL. Returns the results in
+    order, with None for calls not finished by `deadline`.
+    """
+    futures = [BATCH_POOL.submit(func, item) for item in items]
+    wait_until = None if deadline is None else deadline + SEARCH_STAGE_GRACE_SECONDS
+    return [_stage_result(future, None, wait_until) for future in futures]
+
+
+def build_batch_responses(queries, summary_mode, budget):
+    """
+    Runs many plans as one pipeline and returns one result per query, in
+    order: the /search response dict plus 'query', or {'query', 'error'}.
+
+    Identical queries are extracted once, every distinct entity is resolved
+    to a place once, and every distinct place is gathered once, so the cost
+    grows with the number of distinct places rather than plans. Sentiment
+    and summaries run as one batch over all of them; travel and the Gemini
+    review then run once per distinct plan, concurrently under the Gemini
+    rate limiter.
+    """
+    entities_deadline = budget.deadline('entities')
+
+    distinct_queries = list(dict.fromkeys(queries))
+    extracted = _map_until(lambda query: extract_entities_with_gemini(query, deadline=entities_deadline),
+                           distinct_queries, entities_deadline)
+    entities_by_query = dict(zip(distinct_queries, extracted))
+    budget.stage_done('entities')
+    gather_deadline = budget.deadline('gather')
+
+    results = [None] * len(queries)
+    plans = {}  # query index -> entities still to be answered
+    for i, query in enumerate(queries):
+        entities = entities_by_query[query]
+        if not entities:
+            error = ('Timed out identifying the places in your query' if expired(entities_deadline)
+                     else 'Could not identify any places in your query')
+            results[i] = {'query': query, 'error': error}
+            continue
+        if RESPONSE_CACHE:
+            _, cached, _ = get_cached_response(entities, summary_mode)
+            if cached is not None:
+                results[i] = {'query': query, **cached, 'cache': 'hit'}
+                continue
+        plans[i] = entities
+
+    # Resolve each distinct entity once, then gather each distinct place once
+    # (from the first entity text that found it; it now hits the place store)
+    texts = list(dict.fromkeys(db_utils.normalize_query(entity) for entities in plans.values() for entity in entities))
+    places = _map_until(get_place_details, texts, gather_deadline)
+    place_ids = {text: place['place_id'] for text, place in zip(texts, places) if place}
+    place_texts = {}
+    for text, place_id in place_ids.items():
+        place_texts.setdefault(place_id, text)
+    entities_data, late_texts = gather_entities_data(list(place_texts.values()), deadline=gather_deadline,
+                                                     pool=BATCH_POOL, stage_pool=BATCH_STAGE_POOL)
+    by_place = {entity_data['place_id']: entity_data for entity_data in entities_data}
+    logger.info("Batch of %d queries: %d plans, %d distinct entities, %d distinct places",
+                len(queries), len(plans), len(texts), len(place_texts))
+
+    sentiment_on_time = label_sentiments(entities_data, deadline=budget.deadline('inference'))
+    summarize_entities(entities_data, mode=summary_mode, deadline=budget.deadline('inference'))
+
+    def answer(entities):
+        plan_data, late_entities = [], []
+        for entity in entities:
+            text = db_utils.normalize_query(entity)
+            entity_data = by_place.get(place_ids.get(text))
+            if entity_data is not None:
+                plan_data.append(entity_data)
+            elif (text not in place_ids and expired(gather_deadline)) or place_texts.get(place_ids.get(text)) in late_texts:
+                late_entities.append(entity)
+        return finish_plan(plan_data, late_entities, sentiment_on_time, budget)
+
+    # Differently worded queries often extract the same plan
+    distinct_plans = list(dict.fromkeys(tuple(entities) for entities in plans.values()))
+    responses = dict(zip(distinct_plans, _map_until(answer, distinct_plans, None)))
+    for entities, response_data in responses.items():
+        if RESPONSE_CACHE:
+            cache_response(entities, response_data, summary_mode)
+    for index, entities in plans.items():
+        results[index] = {'query': queries[index], **responses[tuple(entities)], 'cache': 'miss'}
+    return results
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_request_latency(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        # For streamed responses this is the time to the first byte
+        metrics_utils.observe(metrics_utils.REQUEST_SECONDS, time.perf_counter() - start,
+                              route=request.url_rule.rule if request.url_rule else "unmatched",
+                              status=response.status_code)
+    return response
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/healthz')
+def healthz():
+    """Liveness probe: the worker is up and serving requests."""
+    return jsonify({'status': 'ok'}), 200
+
+@app.route('/readyz')
+def readyz():
+    """Readiness probe: 200 once the NLP models are loaded, 503 before that."""
+    status = models_status()
+    if models_ready():
+        return jsonify({'status': 'ready', 'models': status}), 200
+    return jsonify({'status': 'loading', 'models': status}), 503
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint: stage histograms, cache and upstream counters."""
+    return Response(metrics_utils.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/search', methods=['POST'])
 def search_entity():
     try:
         data = request.get_json()
         query = data['query']
-        print(f"DEBUG: Received query: {query}")
+        summary_mode = data.get('summary_mode')
+        logger.debug("Received query: %s", query)
+        if summary_mode not in (None,) + SUMMARY_MODES:
+            return jsonify({'error': f"summary_mode must be one of {', '.join(SUMMARY_MODES)}"}), 400
+        try:
+            budget = _search_budget(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        entities = extract_entities_with_gemini(query)
-        print(f"DEBUG: Extracted Entities: {entities}")
+        entities = extract_entities_with_gemini(query, deadline=budget.deadline('entities'))
+        budget.stage_done('entities')
+        logger.debug("Extracted entities: %s", entities)
 
         if not entities:
+            if expired(budget.deadline('entities')):
+                return jsonify({'error': 'Timed out identifying the places in your query'}), 504
             return jsonify({'error': 'Could not identify any places in your query'}), 400
 
-        entities_data = []
-        for entity in entities:
-            place_info = get_place_details(entity)
-            print(f"DEBUG: Google Places Info for {entity}: {place_info}")
-
-            if place_info:
-                latitude = place_info['geometry']['location']['lat']
-                longitude = place_info['geometry']['location']['lng']
-
-                reddit_reviews = scrape_reddit_reviews(place_info['name'], place_info['formatted_address'])
-                print(f"DEBUG: Reddit Reviews for {entity}: {reddit_reviews}")
-
-                all_reviews = []
-                google_reviews = place_info.get('reviews', [])
-                for review in google_reviews:
-                    all_reviews.append(review.copy())
-                for review in reddit_reviews:
-                    all_reviews.append(review.copy())
-
-                for review in all_reviews:
-                    review['sentiment'] = analyze_sentiment(review['text'])
-
-                positive_summary = summarize_reviews(all_reviews, "Positive")
-                negative_summary = summarize_reviews(all_reviews, "Negative")
-
-                weather_data = get_weekend_weather(latitude, longitude)
-                print(f"DEBUG: Weather Data for {entity}: {weather_data}")
-
-                entities_data.append({
-                    'name': place_info['name'],
-                    'reviews': all_reviews,  # Keep all reviews for display
-                    'positive_summary': positive_summary,  # Add summary
-                    'negative_summary': negative_summary,  # Add summary
-                    'weather': weather_data,
-                    'latitude': latitude,
-                    'longitude': longitude
-                })
+        if RESPONSE_CACHE:
+            cache_key, cached, created_at = get_cached_response(entities, summary_mode)
+            if cached is not None:
+                stale = time.time() - created_at >= RESPONSE_CACHE_SOFT_TTL
+                if stale:
+                    schedule_refresh(cache_key, entities, summary_mode)
+                return jsonify({**cached, 'cache': 'stale' if stale else 'hit'}), 200
 
-            else:
-                print(f"DEBUG: Could not retrieve place information for {entity}")
-                # Consider how to handle this.  Maybe skip this entity?
-
-        travel_info = None
-        if len(entities_data) >= 2:
-            lat1 = entities_data[0]['latitude']
-            lon1 = entities_data[0]['longitude']
-            lat2 = entities_data[1]['latitude']
-            lon2 = entities_data[1]['longitude']
-            travel_info = get_travel_info(lat1, lon1, lat2, lon2)
-            print(f"DEBUG: Travel Info: {travel_info}")
-
-        gemini_review = generate_gemini_review(entities_data, travel_info)
-        print(f"DEBUG: Gemini Review: {gemini_review}")
-
-        response_data = {
-            'entities': entities_data,
-            'travel_info': travel_info,
-            'gemini_review': gemini_review
-        }
-        return jsonify(response_data), 200
+        response_data = build_search_response(entities, summary_mode, budget)
+        if RESPONSE_CACHE:
+            cache_response(entities, response_data, summary_mode)
+        return jsonify({**response_data, 'cache': 'miss'}), 200
+
+    except Exception as e:
+        logger.exception("Error in /search route: %s: %s", type(e).__name__, e)
+        return jsonify({'error': 'An unexpected error occurred'}), 500
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch():
+    """
+    Answers many plans at once: {"queries": [...]} -> {"results": [...]},
+    one result per query in input order (see build_batch_responses).
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'queries must be a non-empty list of strings'}), 400
+        queries = data.get('queries')
+        summary_mode = data.get('summary_mode')
+        if not isinstance(queries, list) or not queries or not all(isinstance(query, str) for query in queries):
+            return jsonify({'error': 'queries must be a non-empty list of strings'}), 400
+        if len(queries) > SEARCH_BATCH_MAX_QUERIES:
+            return jsonify({'error': f"At most {SEARCH_BATCH_MAX_QUERIES} queries per batch"}), 400
+        if summary_mode not in (None,) + SUMMARY_MODES:
+            return jsonify({'error': f"summary_mode must be one of {', '.join(SUMMARY_MODES)}"}), 400
+        try:
+            budget = _search_budget(data, _batch_budget_seconds(queries), SEARCH_BATCH_MAX_BUDGET_SECONDS,
+                                    SEARCH_BATCH_STAGE_SPLITS, SEARCH_BATCH_STAGE_RESERVES)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        results = build_batch_responses(queries, summary_mode, budget)
+        logger.info("Answered batch of %d queries in %.1fs", len(queries), budget.elapsed())
+        return jsonify({'results': results}), 200
 
     except Exception as e:
-        print(f"ERROR in /search route: {type(e).__name__}: {e}")
+        logger.exception("Error in /search/batch route: %s: %s", type(e).__name__, e)
         return jsonify({'error': 'An unexpected error occurred'}), 500
 
+def _ndjson(event):
+    return json.dumps(event) + "\n"
+
+# The entity dict keys that make up the 'place' stage payload
+PLACE_STAGE_FIELDS = ('name', 'formatted_address', 'rating', 'website', 'latitude', 'longitude')
+
+def _cached_stream_events(response_data, cache):
+    """
+    Replays a cached /search response as the /search/stream events, in the
+    order a live run sends them. Cached plans have every entity resolved, so
+    the entity indexes line up with the extracted list.
+    """
+    entities_data = response_data['entities']
+    for index, entity_data in enumerate(entities_data):
+        yield {'type': 'place', 'index': index,
+               'place': {key: entity_data[key] for key in PLACE_STAGE_FIELDS}}
+        yield {'type': 'weather', 'index': index, 'weather': entity_data['weather']}
+    for index, entity_data in enumerate(entities_data):
+        yield {'type': 'reviews', 'index': index, 'reviews': entity_data['reviews']}
+    for index, entity_data in enumerate(entities_data):
+        yield {
+            'type': 'summaries',
+            'index': index,
+            'positive_summary': entity_data['positive_summary'],
+            'negative_summary': entity_data['negative_summary']
+        }
+    yield {
+        'type': 'travel_info',
+        'travel_info': response_data['travel_info'],
+        'travel_matrix': response_data['travel_matrix'],
+        'names': [entity_data['name'] for entity_data in entities_data]
+    }
+    gemini_review = response_data['gemini_review']
+    if gemini_review:
+        yield {'type': 'gemini_review_chunk', 'text': gemini_review}
+    yield {'type': 'gemini_review', 'gemini_review': gemini_review}
+    yield {'type': 'done', 'partial': False, 'late': {}, 'cache': cache}
+
+@app.route('/search/stream', methods=['POST'])
+def search_entity_stream():
+    """
+    Streaming variant of /search. Responds with NDJSON, one event per line:
+    'entities', then per-entity 'place', 'weather', 'reviews' and 'summaries'
+    (tagged with the entity's index in the extracted list) as each is ready,
+    then 'travel_info', 'gemini_review_chunk' events as the review is
+    generated, the complete 'gemini_review' and finally 'done' (or 'error').
+    A cached plan is replayed as the same events, and 'done' says whether it
+    came from the cache, as /search's 'cache' field does.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('query'), str) or not data['query'].strip():
+        return jsonify({'error': 'query must be a non-empty string'}), 400
+    query = data['query']
+    summary_mode = data.get('summary_mode')
+    logger.debug("Received streaming query: %s", query)
+    if summary_mode not in (None,) + SUMMARY_MODES:
+        return jsonify({'error': f"summary_mode must be one of {', '.join(SUMMARY_MODES)}"}), 400
+    try:
+        budget = _search_budget(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        try:
+            entities = extract_entities_with_gemini(query, deadline=budget.deadline('entities'))
+            budget.stage_done('entities')
+            logger.debug("Extracted entities: %s", entities)
+            yield _ndjson({'type': 'entities', 'entities': entities})
+
+            if not entities:
+                if expired(budget.deadline('entities')):
+                    yield _ndjson({'type': 'error', 'error': 'Timed out identifying the places in your query'})
+                else:
+                    yield _ndjson({'type': 'error', 'error': 'Could not identify any places in your query'})
+                return
+
+            if RESPONSE_CACHE:
+                cache_key, cached, created_at = get_cached_response(entities, summary_mode)
+                if cached is not None:
+                    stale = time.time() - created_at >= RESPONSE_CACHE_SOFT_TTL
+                    if stale:
+                        schedule_refresh(cache_key, entities, summary_mode)
+                    for event in _cached_stream_events(cached, 'stale' if stale else 'hit'):
+                        yield _ndjson(event)
+                    return
+
+            # Entity workers push stage events onto this queue; a None marks
+            # one worker finishing.
+            events = queue.Queue()
+
+            def stage_reporter(index):
+                def on_stage(stage, payload):
+                    events.put({'type': stage, 'index': index, stage: payload})
+                return on_stage
+
+            gather_deadline = budget.deadline('gather')
+            futures = []
+            for index, entity in enumerate(entities):
+                future = ENTITY_POOL.submit(gather_entity_data, entity, stage_reporter(index), gather_deadline)
+                future.add_done_callback(lambda _: events.put(None))
+                futures.append(future)
+
+            pending = len(futures)
+            while pending:
+                try:
+                    event = events.get(timeout=time_left(gather_deadline + SEARCH_STAGE_GRACE_SECONDS))
+                except queue.Empty:
+                    for future in futures:
+                        future.cancel()  # Deadline: drop the ones not started, go on with those that finished
+                    break
+                if event is None:
+                    pending -= 1
+                else:
+                    yield _ndjson(event)
+
+            finished = [future.done() and not future.cancelled() for future in futures]
+            indexed_entities = [(index, future.result() if finished[index] else None)
+                                for index, future in enumerate(futures)]
+            late_entities = [entities[index] for index in range(len(futures)) if not finished[index]]
+            indexed_entities = [(index, entity_data) for index, entity_data in indexed_entities if entity_data]
+            entities_data = [entity_data for _, entity_data in indexed_entities]
+
+            sentiment_on_time = label_sentiments(entities_data, deadline=budget.deadline('inference'))
+            for index, entity_data in indexed_entities:
+                yield _ndjson({'type': 'reviews', 'index': index, 'reviews': entity_data['reviews']})
+
+            summarize_entities(entities_data, mode=summary_mode, deadline=budget.deadline('inference'))
+            for index, entity_data in indexed_entities:
+                yield _ndjson({
+                    'type': 'summaries',
+                    'index': index,
+                    'positive_summary': entity_data['positive_summary'],
+                    'negative_summary': entity_data['negative_summary']
+                })
+
+            travel_info, travel_matrix = get_plan_travel(entities_data)
+            yield _ndjson({
+                'type': 'travel_info',
+                'travel_info': travel_info,
+                'travel_matrix': travel_matrix,
+                'names': [entity_data['name'] for entity_data in entities_data]
+            })
+
+            # Forward the review as Gemini writes it, then send the full text
+            chunks = []
+            for chunk in generate_gemini_review_stream(entities_data, travel_info, travel_matrix,
+                                                       deadline=budget.deadline('review')):
+                chunks.append(chunk)
+                yield _ndjson({'type': 'gemini_review_chunk', 'text': chunk})
+            gemini_review = "".join(chunks) or None
+            logger.debug("Gemini review: %d chars", len(gemini_review or ""))
+            yield _ndjson({'type': 'gemini_review', 'gemini_review': gemini_review})
+
+            review_late = gemini_review is None and expired(budget.deadline('review'))
+            late = _late_report(entities_data, late_entities, sentiment_on_time, review_late)
+            if RESPONSE_CACHE:
+                cache_response(entities, {
+                    'entities': entities_data,
+                    'travel_info': travel_info,
+                    'travel_matrix': travel_matrix,
+                    'gemini_review': gemini_review,
+                    'partial': bool(late),
+                    'late': late
+                }, summary_mode)
+            yield _ndjson({'type': 'done', 'partial': bool(late), 'late': late, 'cache': 'miss'})
+
+        except Exception as e:
+            logger.exception("Error in /search/stream route: %s: %s", type(e).__name__, e)
+            yield _ndjson({'type': 'error', 'error': 'An unexpected error occurred'})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # REMOVE OR COMMENT OUT THE if __name__ == '__main__': BLOCK
 # if __name__ == '__main__':
 #     app.run(debug=True)
\ No newline at end of file
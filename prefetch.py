@@ -0,0 +1,157 @@
+# prefetch.py
+"""
+Pre-weekend prefetch for the most popular places.
+
+Traffic peaks Thursday to Saturday, just when the upstream APIs are most
+throttled. Run this ahead of the peak (e.g. Thursday and Friday night) to
+precompute, for the places /search resolved most often recently, their place
+details, Google/Reddit/Yelp reviews, sentiment labels, summaries and weekend
+forecast. /search then serves those places from the store and only runs
+travel and the per-plan Gemini review (see main.gather_entity_data).
+
+Every provider gets a call quota for the run: a place is only fetched while
+each provider has room for the most calls a single place has cost so far.
+
+Usage (from the repo root, with the same environment as the web app):
+    python prefetch.py --top 100
+    python prefetch.py --top 50 --quota gmaps=200 --quota reddit=400 --refresh
+    # crontab: 0 2 * * 4,5 cd /app && python prefetch.py
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+
+# Loading the models in the background is for web workers; here they are
+# needed once the reviews are in, so load them on first use.
+os.environ.setdefault("NLP_WARM_UP", "0")
+
+from main import gather_entity_data, label_sentiments, summarize_entities  # noqa: E402
+from utils import db_utils, metrics_utils  # noqa: E402
+from utils.nlp_utils import SUMMARY_MODES  # noqa: E402
+from utils.weather_utils import weekend_dates, weekend_window_end  # noqa: E402
+
+logger = logging.getLogger("prefetch")
+
+PREFETCH_TOP = int(os.environ.get("PREFETCH_TOP", "100"))
+PREFETCH_LOOKBACK_DAYS = float(os.environ.get("PREFETCH_LOOKBACK_DAYS", "14"))
+# A prefetched place is used until the forecast window moves, or for at most
+# this long (reviews and forecasts drift)
+PREFETCH_TTL = int(os.environ.get("PREFETCH_TTL", 36 * 3600))
+# Upstream calls allowed per run, by provider (the metrics_utils provider names)
+PREFETCH_QUOTAS = os.environ.get("PREFETCH_QUOTAS", "gmaps=300,reddit=600,yelp=200,openweathermap=150")
+PREFETCH_SUMMARY_MODE = os.environ.get("PREFETCH_SUMMARY_MODE", "abstractive")
+
+
+def parse_quotas(spec, overrides=()):
+    """'gmaps=300,yelp=200' (plus 'provider=N' overrides) -> {'gmaps': 300, 'yelp': 200}."""
+    quotas = {}
+    for item in [part for part in spec.split(",") if part.strip()] + list(overrides):
+        provider, _, calls = item.partition("=")
+        quotas[provider.strip()] = int(calls)
+    return quotas
+
+
+class QuotaTracker:
+    """
+    Tracks this run's upstream calls per provider through the
+    metrics_utils.UPSTREAM_CALLS counters.
+    """
+
+    def __init__(self, quotas):
+        self.quotas = quotas
+        self.start = {provider: self._count(provider) for provider in quotas}
+        self.max_per_place = {provider: 0 for provider in quotas}
+
+    @staticmethod
+    def _count(provider):
+        return metrics_utils.counter_total(metrics_utils.UPSTREAM_CALLS, provider=provider)
+
+    def used(self):
+        return {provider: self._count(provider) - self.start[provider] for provider in self.quotas}
+
+    def exhausted(self):
+        """Providers without room for another place at the worst cost seen so far."""
+        used = self.used()
+        return [provider for provider, quota in self.quotas.items()
+                if used[provider] + max(self.max_per_place[provider], 1) > quota]
+
+    def record_place(self, used_before):
+        for provider, calls in self.used().items():
+            self.max_per_place[provider] = max(self.max_per_place[provider], calls - used_before[provider])
+
+
+def prefetch_places(places, quotas, summary_mode=PREFETCH_SUMMARY_MODE, refresh=False):
+    """
+    Fetches, labels and summarizes `places` ((place_id, query) pairs, most
+    important first) and stores them for this weekend. Stops fetching once a
+    provider quota would be exceeded. Returns the number of places stored.
+    """
+    saturday = weekend_dates()[0]
+    tracker = QuotaTracker(quotas)
+    fetched = []
+    for place_id, query in places:
+        if not refresh and db_utils.get_prefetched_place(place_id, saturday):
+            logger.debug("Already prefetched: %s", query)
+            continue
+        exhausted = tracker.exhausted()
+        if exhausted:
+            logger.warning("Quota reached for %s, stopping after %d places", ", ".join(exhausted), len(fetched))
+            break
+
+        stages = {}
+        used_before = tracker.used()
+        entity_data = gather_entity_data(query, on_stage=lambda stage, payload: stages.__setitem__(stage, payload),
+                                         use_prefetched=False, record_hit=False)
+        tracker.record_place(used_before)
+        if entity_data is None:
+            logger.info("Could not resolve %s, skipping", query)
+            continue
+        fetched.append((entity_data, stages['place']))
+
+    # One batched pass over every review of every place
+    entities_data = [entity_data for entity_data, _ in fetched]
+    label_sentiments(entities_data)
+    summarize_entities(entities_data, mode=summary_mode)
+
+    stored = 0
+    expires_at = min(weekend_window_end(), time.time() + PREFETCH_TTL)
+    for entity_data, place in fetched:
+        if _summary_failed(entity_data):
+            logger.warning("Summaries failed for %s, not storing it", entity_data['name'])
+            continue
+        db_utils.save_prefetched_place(entity_data['place_id'], saturday,
+                                       {'entity': entity_data, 'place': place}, expires_at)
+        stored += 1
+    logger.info("Prefetched %d places for the weekend of %s; upstream calls: %s",
+                stored, saturday, tracker.used())
+    return stored
+
+
+def _summary_failed(entity_data):
+    # nlp_utils reports a failed summary as its text rather than raising
+    return any(entity_data[key].startswith("Error generating") for key in ('positive_summary', 'negative_summary'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=PREFETCH_TOP, help="How many of the most popular places")
+    parser.add_argument("--lookback-days", type=float, default=PREFETCH_LOOKBACK_DAYS,
+                        help="Only count places resolved within this many days")
+    parser.add_argument("--quota", action="append", default=[],
+                        help="Calls allowed for a provider this run, e.g. gmaps=200 (repeatable)")
+    parser.add_argument("--summary-mode", choices=SUMMARY_MODES, default=PREFETCH_SUMMARY_MODE,
+                        help="Summary tier to precompute")
+    parser.add_argument("--refresh", action="store_true", help="Refetch places already prefetched this weekend")
+    args = parser.parse_args(argv)
+
+    quotas = parse_quotas(PREFETCH_QUOTAS, args.quota)
+    places = db_utils.get_popular_places(args.top, since=time.time() - args.lookback_days * 24 * 3600)
+    logger.info("Prefetching up to %d popular places, quotas %s", len(places), quotas)
+    prefetch_places(places, quotas, summary_mode=args.summary_mode, refresh=args.refresh)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
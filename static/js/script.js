@@ -1,139 +1,212 @@
 // static/js/script.js
-document.getElementById('searchForm').addEventListener('submit', function(event) {
-    event.preventDefault();
 
-    const query = document.getElementById('queryInput').value;
+// --- Shared rendering helpers (used by both the streaming and the plain path) ---
 
-    fetch('/search', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({ query: query })
-    })
-    .then(response => {
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        return response.json();
-    })
-    .then(data => {
-        console.log("DEBUG: Received data:", data); // PRINT ALL DATA
-
-        const resultsDiv = document.getElementById('results');
-        resultsDiv.innerHTML = ''; // Clear previous results
-
-        // --- Display Gemini Review (First) ---
-        if (data.gemini_review) {
-            const geminiDiv = document.createElement('div');
-            geminiDiv.classList.add('gemini-review'); // Add class for styling
-            geminiDiv.innerHTML = marked.parse(data.gemini_review); // USE MARKED.PARSE
-            resultsDiv.appendChild(geminiDiv);
-        }
+function weatherHtml(weather) {
+    let html = '<h3>Weekend Weather</h3>';
+    if (weather.Saturday) {
+        html += `<p>Saturday: ${weather.Saturday.date}, ${weather.Saturday.temperature}°F, ${weather.Saturday.description}</p>`;
+    }
+    if (weather.Sunday) {
+        html += `<p>Sunday: ${weather.Sunday.date}, ${weather.Sunday.temperature}°F, ${weather.Sunday.description}</p>`;
+    }
+    return html;
+}
 
-         // --- Display Travel Info (if available) ---
-        if (data.travel_info) {
-            const travelDiv = document.createElement('div');
-            travelDiv.innerHTML = `<h2>Travel Information</h2>
-                                   <p>Distance: ${data.travel_info.distance}</p>
-                                   <p>Duration: ${data.travel_info.duration}</p>`;
-            resultsDiv.appendChild(travelDiv);
-        }
+function travelHtml(travelInfo, travelMatrix, names) {
+    // With three or more stops, list every leg between them
+    if (travelMatrix && names && names.length > 2) {
+        let html = '<h2>Travel Information</h2><ul>';
+        travelMatrix.forEach((row, i) => {
+            row.forEach((leg, j) => {
+                if (leg && i < j) {
+                    html += `<li>${names[i]} &rarr; ${names[j]}: ${leg.distance}, ${leg.duration}${leg.estimated ? ' (walk, est.)' : ''}</li>`;
+                }
+            });
+        });
+        return html + '</ul>';
+    }
+    return `<h2>Travel Information</h2>
+            <p>Distance: ${travelInfo.distance}</p>
+            <p>Duration: ${travelInfo.duration}</p>`;
+}
 
-        // --- Display data for each entity ---
-        if (data.entities && data.entities.length > 0) {
-            data.entities.forEach(entity => {
-                console.log("DEBUG: Processing entity:", entity); // PRINT EACH ENTITY
-                const entityDiv = document.createElement('div');
-                entityDiv.innerHTML = `<h2>${entity.name}</h2>`;
+function appendSummaries(entityDiv, entity) {
+    if (entity.positive_summary) {
+        const positiveSummaryDiv = document.createElement('div');
+        positiveSummaryDiv.innerHTML = `<strong>Positive Summary:</strong> ${entity.positive_summary}`;
+        entityDiv.appendChild(positiveSummaryDiv);
+    }
+    if (entity.negative_summary) {
+        const negativeSummaryDiv = document.createElement('div');
+        negativeSummaryDiv.innerHTML = `<strong>Negative Summary:</strong> ${entity.negative_summary}`;
+        entityDiv.appendChild(negativeSummaryDiv);
+    }
+}
 
-                // --- Google Sentiment Pie Chart ---
-                if (entity.google_sentiment) {
+function createReviewsTable() {
+    const table = document.createElement('table');
+    const thead = document.createElement('thead');
+    const tbody = document.createElement('tbody');
+    thead.innerHTML = `
+        <tr>
+            <th>Source</th>
+            <th>Review</th>
+            <th>Entity</th>
+            <th>Sentiment</th>
+        </tr>
+    `;
+    table.appendChild(thead);
+    table.appendChild(tbody);
+    return table;
+}
+
+function appendReviewRows(tbody, reviews, entityName) {
+    reviews.forEach(review => {
+        const tr = document.createElement('tr');
+        tr.innerHTML = `
+            <td>${review.source}</td>
+            <td>${review.text} (Rating: ${review.rating || 'N/A'})</td>
+            <td>${entityName}</td>
+            <td>${review.sentiment || 'N/A'}</td>
+        `;
+        tbody.appendChild(tr);
+    });
+}
+
+function lateNoticeHtml(late) {
+    // Sections that missed the request's time budget
+    const parts = [];
+    if (late.entities) parts.push(`places not found in time: ${late.entities.join(', ')}`);
+    if (late.sections) {
+        Object.entries(late.sections).forEach(([name, sections]) => parts.push(`${name}: ${sections.join(', ')}`));
+    }
+    if (late.sentiment) parts.push('sentiment labels');
+    if (late.gemini_review) parts.push('the trip review');
+    return `<p class="late-notice"><em>Some results took too long and were left out (${parts.join('; ')}).</em></p>`;
+}
+
+// --- Plain /search: render the whole response at once ---
+
+function renderResults(data) {
+    console.log("DEBUG: Received data:", data); // PRINT ALL DATA
+
+    const resultsDiv = document.getElementById('results');
+    resultsDiv.innerHTML = ''; // Clear previous results
+
+    if (data.partial) {
+        resultsDiv.insertAdjacentHTML('beforeend', lateNoticeHtml(data.late));
+    }
+
+    // --- Display Gemini Review (First) ---
+    if (data.gemini_review) {
+        const geminiDiv = document.createElement('div');
+        geminiDiv.classList.add('gemini-review'); // Add class for styling
+        geminiDiv.innerHTML = marked.parse(data.gemini_review); // USE MARKED.PARSE
+        resultsDiv.appendChild(geminiDiv);
+    }
+
+    // --- Display Travel Info (if available) ---
+    if (data.travel_info) {
+        const travelDiv = document.createElement('div');
+        travelDiv.innerHTML = travelHtml(data.travel_info, data.travel_matrix, (data.entities || []).map(entity => entity.name));
+        resultsDiv.appendChild(travelDiv);
+    }
+
+    // --- Display data for each entity ---
+    if (data.entities && data.entities.length > 0) {
+        data.entities.forEach(entity => {
+            console.log("DEBUG: Processing entity:", entity); // PRINT EACH ENTITY
+            const entityDiv = document.createElement('div');
+            entityDiv.innerHTML = `<h2>${entity.name}</h2>`;
+
+            // --- Google Sentiment Pie Chart ---
+            if (entity.google_sentiment) {
 					console.log("DEBUG: google sentiment", entity.google_sentiment)
-                    const canvas = document.createElement('canvas');
-                    canvas.width = 100;  // Reduced width to 100px (50% of 200px)
-                    canvas.height = 100; // Reduced height to 100px
-                    canvas.id = `google-chart-${entity.name}`; //MUST BE UNIQUE
-                    entityDiv.appendChild(canvas);
-                    const ctx = canvas.getContext('2d');
-                    const myChart = new Chart(ctx, {
-                        type: 'pie',
-                        data: {
-                            labels: Object.keys(entity.google_sentiment),
-                            datasets: [{
-                                data: Object.values(entity.google_sentiment),
-                                backgroundColor: [
-                                    'darkgreen',    // Highly Positive - Dark Green
-                                    'lightgreen',   // Positive - Light Green
-                                    'lightgray',   // Neutral - Light Gray
-                                    'lightcoral',  // Negative - Light Red
-                                    'darkred'      // Highly Negative - Dark Red
-                                ],
-                            }]
-                        },
-                        options: {
-                            plugins: {
-                                title: {
-                                    display: true,
-                                    text: 'Google Reviews Sentiment'
-                                },
-                                legend: {
-                                    labels: {
-                                        generateLabels: function(chart) {
-                                            const originalLabels = Chart.overrides.pie.plugins.legend.labels.generateLabels(chart);
-                                            const colorMap = {
-                                                'Highly Positive': 'darkgreen',
-                                                'Positive': 'lightgreen',
-                                                'Neutral': 'lightgray',
-                                                'Negative': 'lightcoral',
-                                                'Highly Negative': 'darkred',
-                                            };
-                                            originalLabels.forEach(label => {
-                                                if (colorMap[label.text]) {
-                                                    label.fillStyle = colorMap[label.text];
-                                                    label.strokeStyle = colorMap[label.text];
-                                                }
-                                            });
-                                            return originalLabels;
-                                        }
+                const canvas = document.createElement('canvas');
+                canvas.width = 100;  // Reduced width to 100px (50% of 200px)
+                canvas.height = 100; // Reduced height to 100px
+                canvas.id = `google-chart-${entity.name}`; //MUST BE UNIQUE
+                entityDiv.appendChild(canvas);
+                const ctx = canvas.getContext('2d');
+                const myChart = new Chart(ctx, {
+                    type: 'pie',
+                    data: {
+                        labels: Object.keys(entity.google_sentiment),
+                        datasets: [{
+                            data: Object.values(entity.google_sentiment),
+                            backgroundColor: [
+                                'darkgreen',    // Highly Positive - Dark Green
+                                'lightgreen',   // Positive - Light Green
+                                'lightgray',   // Neutral - Light Gray
+                                'lightcoral',  // Negative - Light Red
+                                'darkred'      // Highly Negative - Dark Red
+                            ],
+                        }]
+                    },
+                    options: {
+                        plugins: {
+                            title: {
+                                display: true,
+                                text: 'Google Reviews Sentiment'
+                            },
+                            legend: {
+                                labels: {
+                                    generateLabels: function(chart) {
+                                        const originalLabels = Chart.overrides.pie.plugins.legend.labels.generateLabels(chart);
+                                        const colorMap = {
+                                            'Highly Positive': 'darkgreen',
+                                            'Positive': 'lightgreen',
+                                            'Neutral': 'lightgray',
+                                            'Negative': 'lightcoral',
+                                            'Highly Negative': 'darkred',
+                                        };
+                                        originalLabels.forEach(label => {
+                                            if (colorMap[label.text]) {
+                                                label.fillStyle = colorMap[label.text];
+                                                label.strokeStyle = colorMap[label.text];
+                                            }
+                                        });
+                                        return originalLabels;
                                     }
                                 }
                             }
                         }
-                    });
-                }
+                    }
+                });
+            }
 
-                // --- Reddit Sentiment Pie Chart ---
-                if (entity.reddit_sentiment) {
+            // --- Reddit Sentiment Pie Chart ---
+            if (entity.reddit_sentiment) {
 					console.log("DEBUG: reddit sentiment", entity.reddit_sentiment)
-                    const canvas = document.createElement('canvas');
-                    canvas.width = 100;  // Reduced width
-                    canvas.height = 100; // Reduced height
-                    canvas.id = `reddit-chart-${entity.name}`; //MUST BE UNIQUE
-                    entityDiv.appendChild(canvas);
-                    const ctx = canvas.getContext('2d');
-                    const myChart = new Chart(ctx, {
-                        type: 'pie',
-                        data: {
-                            labels: Object.keys(entity.reddit_sentiment),
-                            datasets: [{
-                                data: Object.values(entity.reddit_sentiment),
-                                backgroundColor: [
-                                     'darkgreen',    // Highly Positive - Dark Green
-                                    'lightgreen',   // Positive - Light Green
-                                    'lightgray',   // Neutral - Light Gray
-                                    'lightcoral',  // Negative - Light Red
-                                    'darkred'      // Highly Negative - Dark Red
-                                ],
-                            }]
-                        },
-                         options: {
-                            plugins: {
-                                title: {
-                                    display: true,
-                                    text: 'Reddit Reviews Sentiment'
-                                },
-                                legend: {
+                const canvas = document.createElement('canvas');
+                canvas.width = 100;  // Reduced width
+                canvas.height = 100; // Reduced height
+                canvas.id = `reddit-chart-${entity.name}`; //MUST BE UNIQUE
+                entityDiv.appendChild(canvas);
+                const ctx = canvas.getContext('2d');
+                const myChart = new Chart(ctx, {
+                    type: 'pie',
+                    data: {
+                        labels: Object.keys(entity.reddit_sentiment),
+                        datasets: [{
+                            data: Object.values(entity.reddit_sentiment),
+                            backgroundColor: [
+                                 'darkgreen',    // Highly Positive - Dark Green
+                                'lightgreen',   // Positive - Light Green
+                                'lightgray',   // Neutral - Light Gray
+                                'lightcoral',  // Negative - Light Red
+                                'darkred'      // Highly Negative - Dark Red
+                            ],
+                        }]
+                    },
+                     options: {
+                        plugins: {
+                            title: {
+                                display: true,
+                                text: 'Reddit Reviews Sentiment'
+                            },
+                            legend: {
 									labels: {
 										generateLabels: function(chart) {
 											const originalLabels = Chart.overrides.pie.plugins.legend.labels.generateLabels(chart);
@@ -155,74 +228,192 @@ document.getElementById('searchForm').addEventListener('submit', function(event)
 										}
 									}
 								}
-                            }
                         }
-                    });
-                }
+                    }
+                });
+            }
 
 
-                // Weather
-                if (entity.weather) {
-                    entityDiv.innerHTML += '<h3>Weekend Weather</h3>';
-                    if (entity.weather.Saturday) {
-                        entityDiv.innerHTML += `<p>Saturday: ${entity.weather.Saturday.date}, ${entity.weather.Saturday.temperature}°F, ${entity.weather.Saturday.description}</p>`;
-                    }
-                    if (entity.weather.Sunday) {
-                        entityDiv.innerHTML += `<p>Sunday: ${entity.weather.Sunday.date}, ${entity.weather.Sunday.temperature}°F, ${entity.weather.Sunday.description}</p>`;
-                    }
-                }
-                if (entity.positive_summary) {
-                    const positiveSummaryDiv = document.createElement('div');
-                    positiveSummaryDiv.innerHTML = `<strong>Positive Summary:</strong> ${entity.positive_summary}`;
-                    entityDiv.appendChild(positiveSummaryDiv);
-                }
-                if (entity.negative_summary) {
-                    const negativeSummaryDiv = document.createElement('div');
-                    negativeSummaryDiv.innerHTML = `<strong>Negative Summary:</strong> ${entity.negative_summary}`;
-                    entityDiv.appendChild(negativeSummaryDiv);
-        		}
-                resultsDiv.appendChild(entityDiv);
+            // Weather
+            if (entity.weather) {
+                entityDiv.insertAdjacentHTML('beforeend', weatherHtml(entity.weather));
+            }
+            appendSummaries(entityDiv, entity);
+            resultsDiv.appendChild(entityDiv);
+        });
+    }
+    else {
+      resultsDiv.textContent = 'Could not identify any places'
+    }
+
+
+    // --- Display Reviews (as a footnote table) ---
+    if (data.entities && data.entities.length > 0) {
+        const table = createReviewsTable();
+        const tbody = table.querySelector('tbody');
+        data.entities.forEach(entity => {
+            if (entity.reviews && entity.reviews.length > 0){
+                appendReviewRows(tbody, entity.reviews, entity.name);
+            }
+        });
+        resultsDiv.appendChild(table);
+    }
+}
+
+// --- /search/stream: render each NDJSON event as it arrives ---
+
+function createStreamView(resultsDiv) {
+    resultsDiv.innerHTML = ''; // Clear previous results
+
+    const geminiDiv = document.createElement('div');
+    geminiDiv.classList.add('gemini-review');
+    geminiDiv.innerHTML = '<p><em>Writing your weekend review...</em></p>';
+    const travelDiv = document.createElement('div');
+    const entitiesDiv = document.createElement('div');
+    const table = createReviewsTable();
+    table.style.display = 'none'; // Shown once the first reviews arrive
+
+    resultsDiv.appendChild(geminiDiv);
+    resultsDiv.appendChild(travelDiv);
+    resultsDiv.appendChild(entitiesDiv);
+    resultsDiv.appendChild(table);
+
+    return {
+        resultsDiv: resultsDiv,
+        geminiDiv: geminiDiv,
+        travelDiv: travelDiv,
+        entitiesDiv: entitiesDiv,
+        table: table,
+        entityDivs: [],   // One per extracted entity, by index
+        entityNames: [],
+        reviewMarkdown: ''  // Gemini review text received so far
+    };
+}
+
+function handleStreamEvent(view, event) {
+    switch (event.type) {
+        case 'entities':
+            event.entities.forEach((name, index) => {
+                const entityDiv = document.createElement('div');
+                entityDiv.innerHTML = `<h2>${name}</h2><p><em>Looking up place...</em></p>`;
+                view.entitiesDiv.appendChild(entityDiv);
+                view.entityDivs[index] = entityDiv;
+                view.entityNames[index] = name;
             });
+            break;
+        case 'place': {
+            const entityDiv = view.entityDivs[event.index];
+            if (!event.place) {
+                entityDiv.remove();
+                break;
+            }
+            view.entityNames[event.index] = event.place.name;
+            entityDiv.innerHTML = `<h2>${event.place.name}</h2>`;
+            break;
         }
-        else {
-          resultsDiv.textContent = 'Could not identify any places'
-        }
+        case 'weather':
+            if (event.weather) {
+                view.entityDivs[event.index].insertAdjacentHTML('beforeend', weatherHtml(event.weather));
+            }
+            break;
+        case 'reviews':
+            if (event.reviews && event.reviews.length > 0) {
+                view.table.style.display = '';
+                appendReviewRows(view.table.querySelector('tbody'), event.reviews, view.entityNames[event.index]);
+            }
+            break;
+        case 'summaries':
+            appendSummaries(view.entityDivs[event.index], event);
+            break;
+        case 'travel_info':
+            if (event.travel_info) {
+                view.travelDiv.innerHTML = travelHtml(event.travel_info, event.travel_matrix, event.names);
+            }
+            break;
+        case 'gemini_review_chunk':
+            // Re-render the markdown received so far on every chunk
+            view.reviewMarkdown += event.text;
+            view.geminiDiv.innerHTML = marked.parse(view.reviewMarkdown);
+            break;
+        case 'gemini_review':
+            if (event.gemini_review) {
+                view.geminiDiv.innerHTML = marked.parse(event.gemini_review); // USE MARKED.PARSE
+            } else {
+                view.geminiDiv.remove();
+            }
+            break;
+        case 'error':
+            view.resultsDiv.textContent = event.error;
+            break;
+        case 'done':
+            if (event.partial) {
+                view.resultsDiv.insertAdjacentHTML('afterbegin', lateNoticeHtml(event.late));
+            }
+            break;
+        default:
+            console.log("DEBUG: Unknown stream event:", event);
+    }
+}
 
+async function streamSearch(query) {
+    const response = await fetch('/search/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ query: query })
+    });
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
 
-        // --- Display Reviews (as a footnote table) ---
-        if (data.entities && data.entities.length > 0) {
-            const table = document.createElement('table');
-            const thead = document.createElement('thead');
-            const tbody = document.createElement('tbody');
-            thead.innerHTML = `
-                <tr>
-                    <th>Source</th>
-                    <th>Review</th>
-                    <th>Entity</th>
-                    <th>Sentiment</th>
-                </tr>
-            `;
-            table.appendChild(thead);
-            table.appendChild(tbody);
-            data.entities.forEach(entity => {
-                if (entity.reviews && entity.reviews.length > 0){
-                    entity.reviews.forEach(review => {
-                    const tr = document.createElement('tr');
-                    tr.innerHTML = `
-                        <td>${review.source}</td>
-                        <td>${review.text} (Rating: ${review.rating || 'N/A'})</td>
-                        <td>${entity.name}</td>
-                        <td>${review.sentiment}</td>
-                    `;
-                    tbody.appendChild(tr);
-                });
-               }
-            });
-            resultsDiv.appendChild(table);
+    const view = createStreamView(document.getElementById('results'));
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
 
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
         }
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop(); // Keep any partial line for the next chunk
+        lines.filter(line => line.trim()).forEach(line => handleStreamEvent(view, JSON.parse(line)));
+    }
+    if (buffer.trim()) {
+        handleStreamEvent(view, JSON.parse(buffer));
+    }
+}
+
+function plainSearch(query) {
+    return fetch('/search', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ query: query })
     })
-    .catch(error => {
+    .then(response => {
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        return response.json();
+    })
+    .then(renderResults);
+}
+
+document.getElementById('searchForm').addEventListener('submit', function(event) {
+    event.preventDefault();
+
+    const query = document.getElementById('queryInput').value;
+
+    // Stream results when the browser can read response bodies incrementally
+    const canStream = window.ReadableStream && window.TextDecoder;
+    const search = canStream ? streamSearch(query) : plainSearch(query);
+
+    search.catch(error => {
         console.error('Error:', error);
         document.getElementById('results').textContent = `An error occurred: ${error.message}`;
     });
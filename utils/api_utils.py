@@ -1,19 +1,102 @@
 # utils/api_utils.py
 import os
+import logging
 import googlemaps
 from dotenv import load_dotenv
+from utils import db_utils
+from utils.metrics_utils import timed, record_cache, record_upstream_call
+from utils.singleflight_utils import single_flight
 
 load_dotenv()  # Load environment variables from .env file
 
+logger = logging.getLogger(__name__)
+
 gmaps = googlemaps.Client(key=os.environ.get("GOOGLE_MAPS_API_KEY"))
 
+DETAIL_FIELDS = ["name", "formatted_address", "rating", "website", "formatted_phone_number"]
+
+
+def _format_reviews(raw_reviews):
+    """
+    Adds 'source': 'Google' to each review, and limits to 5 reviews.
+    """
+    reviews = []
+    # Limit to 5 reviews AND ensure reviews exist
+    for review in raw_reviews[:5]:  # Limit to 5 reviews
+        review_data = {
+            'source': 'Google',
+            'text': review.get('text'),
+            'rating': review.get('rating'),
+            'date': review.get('relative_time_description'),
+            'user': review.get('author_name')
+        }
+        reviews.append(review_data)
+    return reviews
+
+
+def _build_place(place_id, details, geometry, reviews):
+    return {
+        "place_id": place_id,
+        "name": details.get("name"),
+        "formatted_address": details.get("formatted_address"),
+        "rating": details.get("rating"),
+        "website": details.get("website"),
+        "formatted_phone_number": details.get("formatted_phone_number"),
+        "reviews": reviews,  # Limited reviews
+        "geometry": geometry
+    }
+
+
+def _refresh_reviews(place_id):
+    """
+    Fetches only the reviews for a place we already have static details for.
+    Returns the formatted reviews, or None on error.
+    """
+    record_upstream_call("gmaps", "place_reviews")
+    place_details = gmaps.place(place_id=place_id, fields=["review"])
+    if place_details["status"] != "OK":
+        logger.error("Error refreshing place reviews: %s", place_details['status'])
+        return None
+    reviews = _format_reviews(place_details["result"].get("reviews", []))
+    db_utils.save_place_reviews(place_id, reviews)
+    return reviews
+
+
+def _from_store(place_id, stored, geometry):
+    """
+    Builds the place from stored static details, refreshing reviews if stale.
+    """
+    reviews = stored['reviews']
+    if not stored['reviews_fresh'] or reviews is None:
+        refreshed = _refresh_reviews(place_id)
+        if refreshed is not None:
+            reviews = refreshed
+    return _build_place(place_id, stored['details'], geometry, reviews or [])
+
+
+@timed("place_lookup")
+@single_flight("place_lookup", key=lambda query: db_utils.normalize_query(query))
 def get_place_details(query):
     """
     Retrieves place ID and details from the Google Places API.
     Adds 'source': 'Google' to each review, and limits to 5 reviews.
+
+    Reads through the local place store (utils/db_utils.py): a recently
+    resolved query skips Find Place, fresh details are served from the store,
+    and stale reviews are refreshed without refetching the static fields.
+    Concurrent lookups of the same query share one call.
     """
     try:
+        # 0. Local place store
+        place_id = db_utils.get_place_id_for_query(query)
+        stored = db_utils.get_place(place_id) if place_id else None
+        if stored and stored['details_fresh'] and stored['details'] and stored['geometry']:
+            record_cache("place_store", hit=True)
+            return _from_store(place_id, stored, stored['geometry'])
+        record_cache("place_store", hit=False)
+
         # 1. Find Place (to get the place_id)
+        record_upstream_call("gmaps", "find_place")
         places_result = gmaps.find_place(
             input=query,
             input_type="textquery",
@@ -22,55 +105,40 @@ def get_place_details(query):
 
         if places_result["status"] == "OK" and places_result["candidates"]:
             place_id = places_result["candidates"][0]["place_id"]
-            place_name = places_result["candidates"][0]["name"]
-            place_address = places_result["candidates"][0]["formatted_address"]
             geometry = places_result["candidates"][0]['geometry']
-            location = geometry['location']
-            latitude = location['lat']
-            longitude = location['lng']
+            db_utils.save_query(query, place_id)
 
+            # Different query text, same place: reuse what we have
+            stored = db_utils.get_place(place_id)
+            if stored and stored['details_fresh'] and stored['details']:
+                return _from_store(place_id, stored, geometry)
 
             # 2. Place Details
+            record_upstream_call("gmaps", "place")
             place_details = gmaps.place(
                 place_id=place_id,
-                fields=["name", "formatted_address", "rating", "website", "formatted_phone_number", "review"]
+                fields=DETAIL_FIELDS + ["review"]
             )
 
             if place_details["status"] == "OK":
                 result = place_details["result"]
-                reviews = []
-                # Limit to 5 reviews AND ensure reviews exist
-                for review in result.get("reviews", [])[:5]:  # Limit to 5 reviews
-                    review_data = {
-                        'source': 'Google',
-                        'text': review.get('text'),
-                        'rating': review.get('rating'),
-                        'date': review.get('relative_time_description'),
-                        'user': review.get('author_name')
-                    }
-                    reviews.append(review_data)
-
-                return_val = {
-                    "place_id": place_id,
-                    "name": result.get("name"),
-                    "formatted_address": result.get("formatted_address"),
-                    "rating": result.get("rating"),
-                    "website": result.get("website"),
-                    "formatted_phone_number": result.get("formatted_phone_number"),
-                    "reviews": reviews,  # Limited reviews
-                    "geometry": geometry
-                }
-                return return_val
+                reviews = _format_reviews(result.get("reviews", []))
+                details = {field: result.get(field) for field in DETAIL_FIELDS}
+
+                db_utils.save_place_details(place_id, details, geometry)
+                db_utils.save_place_reviews(place_id, reviews)
+
+                return _build_place(place_id, details, geometry, reviews)
             else:
-                print(f"Error getting place details: {place_details['status']}")
+                logger.error("Error getting place details: %s", place_details['status'])
                 return None
         elif places_result["status"] == "ZERO_RESULTS":
-            print("No results found for that query.")
+            logger.info("No results found for that query.")
             return None
         else:
-            print(f"Error in Find Place search: {places_result['status']}")
+            logger.error("Error in Find Place search: %s", places_result['status'])
             return None
 
     except Exception as e:
-        print(f"An unexpected error occurred in get_place_details: {type(e).__name__}: {e}")
-        return None
\ No newline at end of file
+        logger.error("An unexpected error occurred in get_place_details: %s: %s", type(e).__name__, e)
+        return None
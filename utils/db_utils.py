@@ -0,0 +1,360 @@
+# utils/db_utils.py
+import os
+import json
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# App Engine only lets us write under /tmp, so default to the temp dir.
+DB_PATH = os.environ.get("PLACES_DB_PATH", os.path.join(tempfile.gettempdir(), "weekend_fun_rater.db"))
+
+# Per-field freshness, in seconds. Static place fields (name, address,
+# geometry, website...) rarely change; reviews change often.
+QUERY_TTL = int(os.environ.get("PLACES_QUERY_TTL", 7 * 24 * 3600))      # query text -> place_id
+DETAILS_TTL = int(os.environ.get("PLACES_DETAILS_TTL", 30 * 24 * 3600))  # static details + geometry
+REVIEWS_TTL = int(os.environ.get("PLACES_REVIEWS_TTL", 24 * 3600))       # Google reviews
+# Sentiment labels never go stale, but /tmp can be instance memory: keep
+# them for a while and cap the table, dropping the oldest first.
+SENTIMENT_CACHE_TTL = int(os.environ.get("SENTIMENT_CACHE_TTL", 30 * 24 * 3600))
+SENTIMENT_CACHE_MAX_ROWS = int(os.environ.get("SENTIMENT_CACHE_MAX_ROWS", "200000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS place_queries (
+    query TEXT PRIMARY KEY,
+    place_id TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS places (
+    place_id TEXT PRIMARY KEY,
+    details TEXT,
+    geometry TEXT,
+    details_fetched_at REAL,
+    reviews TEXT,
+    reviews_fetched_at REAL
+);
+CREATE TABLE IF NOT EXISTS sentiment_cache (
+    key TEXT PRIMARY KEY,
+    label TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sentiment_cache_created ON sentiment_cache (created_at);
+CREATE TABLE IF NOT EXISTS response_cache (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS place_popularity (
+    place_id TEXT PRIMARY KEY,
+    query TEXT NOT NULL,
+    hits INTEGER NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS prefetched_places (
+    place_id TEXT NOT NULL,
+    weekend TEXT NOT NULL,
+    record TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (place_id, weekend)
+);
+"""
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_initialized_paths = set()
+
+
+def get_connection(path=None, schema=SCHEMA):
+    """
+    Returns this thread's SQLite connection for `path` (default DB_PATH),
+    creating `schema` the first time the file is opened.
+    """
+    path = path or DB_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")  # Readers don't block the writer
+        conn.execute("PRAGMA synchronous=NORMAL")
+        connections[path] = conn
+
+    if path not in _initialized_paths:
+        with _schema_lock:
+            if path not in _initialized_paths:
+                conn.executescript(schema)
+                conn.commit()
+                _initialized_paths.add(path)
+    return conn
+
+
+def normalize_query(query):
+    """Lowercases and collapses whitespace so trivially different queries share a key."""
+    return " ".join((query or "").lower().split())
+
+
+def _is_fresh(fetched_at, ttl):
+    return fetched_at is not None and (time.time() - fetched_at) < ttl
+
+
+def get_place_id_for_query(query):
+    """
+    Returns the place_id a query resolved to recently, or None.
+    """
+    try:
+        row = get_connection().execute(
+            "SELECT place_id, fetched_at FROM place_queries WHERE query = ?",
+            (normalize_query(query),)
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.error("Error reading place_queries: %s: %s", type(e).__name__, e)
+        return None
+    if row and _is_fresh(row["fetched_at"], QUERY_TTL):
+        return row["place_id"]
+    return None
+
+
+def save_query(query, place_id):
+    """Remembers which place_id a query resolved to."""
+    try:
+        conn = get_connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO place_queries (query, place_id, fetched_at) VALUES (?, ?, ?)",
+            (normalize_query(query), place_id, time.time())
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error("Error saving place query: %s: %s", type(e).__name__, e)
+
+
+def get_place(place_id):
+    """
+    Returns the stored record for a place, or None if we have never seen it.
+
+    The record looks like:
+        {
+            'place_id': ...,
+            'details': {...} or None,    # name, address, rating, website, phone
+            'geometry': {...} or None,
+            'reviews': [...] or None,
+            'details_fresh': bool,
+            'reviews_fresh': bool,
+        }
+    """
+    try:
+        row = get_connection().execute(
+            "SELECT * FROM places WHERE place_id = ?", (place_id,)
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.error("Error reading place %s: %s: %s", place_id, type(e).__name__, e)
+        return None
+    if row is None:
+        return None
+
+    return {
+        'place_id': place_id,
+        'details': json.loads(row["details"]) if row["details"] else None,
+        'geometry': json.loads(row["geometry"]) if row["geometry"] else None,
+        'reviews': json.loads(row["reviews"]) if row["reviews"] is not None else None,
+        'details_fresh': _is_fresh(row["details_fetched_at"], DETAILS_TTL),
+        'reviews_fresh': _is_fresh(row["reviews_fetched_at"], REVIEWS_TTL),
+    }
+
+
+def save_place_details(place_id, details, geometry):
+    """Stores a place's static details and geometry."""
+    try:
+        conn = get_connection()
+        conn.execute(
+            """INSERT INTO places (place_id, details, geometry, details_fetched_at)
+               VALUES (?, ?, ?, ?)
+               ON CONFLICT(place_id) DO UPDATE SET
+                   details = excluded.details,
+                   geometry = excluded.geometry,
+                   details_fetched_at = excluded.details_fetched_at""",
+            (place_id, json.dumps(details), json.dumps(geometry), time.time())
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error("Error saving place details for %s: %s: %s", place_id, type(e).__name__, e)
+
+
+def save_place_reviews(place_id, reviews):
+    """Stores (or refreshes) a place's reviews without touching its static fields."""
+    try:
+        conn = get_connection()
+        conn.execute(
+            """INSERT INTO places (place_id, reviews, reviews_fetched_at)
+               VALUES (?, ?, ?)
+               ON CONFLICT(place_id) DO UPDATE SET
+                   reviews = excluded.reviews,
+                   reviews_fetched_at = excluded.reviews_fetched_at""",
+            (place_id, json.dumps(reviews), time.time())
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error("Error saving reviews for %s: %s: %s", place_id, type(e).__name__, e)
+
+
+# --- Sentiment label cache (disk tier for utils/nlp_utils.py) ---
+
+
+def get_cached_sentiments(keys):
+    """
+    Looks up sentiment labels by content key. Returns {key: label} for hits.
+    """
+    if not keys:
+        return {}
+    hits = {}
+    try:
+        conn = get_connection()
+        keys = list(keys)
+        for start in range(0, len(keys), 500):  # Stay under SQLite's variable limit
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for row in conn.execute(
+                f"SELECT key, label FROM sentiment_cache WHERE key IN ({placeholders})", chunk
+            ):
+                hits[row["key"]] = row["label"]
+    except sqlite3.Error as e:
+        logger.error("Error reading sentiment cache: %s: %s", type(e).__name__, e)
+    return hits
+
+
+def save_sentiments(labels_by_key):
+    """
+    Stores {key: label} sentiment results, dropping labels older than
+    SENTIMENT_CACHE_TTL and the oldest beyond SENTIMENT_CACHE_MAX_ROWS.
+    """
+    if not labels_by_key:
+        return
+    try:
+        conn = get_connection()
+        now = time.time()
+        conn.execute("DELETE FROM sentiment_cache WHERE created_at <= ?", (now - SENTIMENT_CACHE_TTL,))
+        conn.execute(
+            """DELETE FROM sentiment_cache WHERE created_at <= (
+                   SELECT created_at FROM sentiment_cache ORDER BY created_at DESC LIMIT 1 OFFSET ?)""",
+            (max(SENTIMENT_CACHE_MAX_ROWS - len(labels_by_key), 0),)
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO sentiment_cache (key, label, created_at) VALUES (?, ?, ?)",
+            [(key, label, now) for key, label in labels_by_key.items()]
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error("Error saving sentiment cache: %s: %s", type(e).__name__, e)
+
+
+
+# --- Full /search response cache (see main.py) ---
+
+
+def get_cached_response(key):
+    """
+    Returns (response, created_at) for an unexpired cached response, or None.
+    """
+    try:
+        row = get_connection().execute(
+            "SELECT response, created_at, expires_at FROM response_cache WHERE key = ?", (key,)
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.error("Error reading response cache: %s: %s", type(e).__name__, e)
+        return None
+    if row is None or time.time() >= row["expires_at"]:
+        return None
+    return json.loads(row["response"]), row["created_at"]
+
+
+def save_cached_response(key, response, expires_at):
+    """Stores a response until `expires_at` (Unix time), dropping expired ones."""
+    try:
+        conn = get_connection()
+        now = time.time()
+        conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, response, created_at, expires_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(response), now, expires_at)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error("Error saving response cache: %s: %s", type(e).__name__, e)
+
+
+# --- Place popularity and pre-weekend prefetch (see prefetch.py) ---
+
+
+def record_place_hit(place_id, query):
+    """Counts one /search resolving to a place, remembering the query that found it."""
+    try:
+        conn = get_connection()
+        conn.execute(
+            """INSERT INTO place_popularity (place_id, query, hits, last_seen)
+               VALUES (?, ?, 1, ?)
+               ON CONFLICT(place_id) DO UPDATE SET
+                   query = excluded.query,
+                   hits = hits + 1,
+                   last_seen = excluded.last_seen""",
+            (place_id, normalize_query(query), time.time())
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error("Error recording place hit for %s: %s: %s", place_id, type(e).__name__, e)
+
+
+def get_popular_places(limit, since=0):
+    """
+    The `limit` most frequently resolved places seen since `since` (Unix
+    time), as (place_id, query) pairs, most popular first.
+    """
+    try:
+        rows = get_connection().execute(
+            "SELECT place_id, query FROM place_popularity WHERE last_seen >= ? ORDER BY hits DESC LIMIT ?",
+            (since, limit)
+        ).fetchall()
+    except sqlite3.Error as e:
+        logger.error("Error reading place popularity: %s: %s", type(e).__name__, e)
+        return []
+    return [(row["place_id"], row["query"]) for row in rows]
+
+
+def get_prefetched_place(place_id, weekend):
+    """Returns the unexpired prefetched record for a place and weekend, or None."""
+    try:
+        row = get_connection().execute(
+            "SELECT record, expires_at FROM prefetched_places WHERE place_id = ? AND weekend = ?",
+            (place_id, weekend)
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.error("Error reading prefetched place %s: %s: %s", place_id, type(e).__name__, e)
+        return None
+    if row is None or time.time() >= row["expires_at"]:
+        return None
+    return json.loads(row["record"])
+
+
+def save_prefetched_place(place_id, weekend, record, expires_at):
+    """Stores a prefetched record until `expires_at`, dropping expired ones."""
+    try:
+        conn = get_connection()
+        now = time.time()
+        conn.execute("DELETE FROM prefetched_places WHERE expires_at <= ?", (now,))
+        conn.execute(
+            """INSERT OR REPLACE INTO prefetched_places (place_id, weekend, record, created_at, expires_at)
+               VALUES (?, ?, ?, ?, ?)""",
+            (place_id, weekend, json.dumps(record), now, expires_at)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error("Error saving prefetched place %s: %s: %s", place_id, type(e).__name__, e)
@@ -0,0 +1,62 @@
+# utils/deadline_utils.py
+import time
+
+
+def time_left(deadline):
+    """
+    Seconds until `deadline` (a time.monotonic() value), never negative.
+    None if there is no deadline.
+    """
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def expired(deadline):
+    """True once `deadline` has passed. A None deadline never expires."""
+    return deadline is not None and time.monotonic() >= deadline
+
+
+class Budget:
+    """
+    An overall time budget split into stage deadlines.
+
+    `splits` is a list of (stage, fraction) pairs with cumulative fractions,
+    e.g. [("gather", 0.5), ("review", 1.0)]: gathering must finish by half of
+    the budget, and the review by the end. A stage that finishes early
+    leaves its unused time to the later ones.
+
+    `reserves` maps a stage to the fraction of the budget that must be left
+    for the stages after it: such a stage may run past its split, borrowing
+    time planned for later stages, until only that much is left. Call
+    stage_done() when it finishes so the later stages share what remains.
+    """
+
+    def __init__(self, seconds, splits, reserves=None):
+        self.seconds = seconds
+        self.start = time.monotonic()
+        self.end = self.start + seconds
+        self.fractions = dict(splits)
+        self.deadlines = {stage: self.start + seconds * fraction for stage, fraction in splits}
+        for stage, reserve in (reserves or {}).items():
+            self.deadlines[stage] = max(self.deadlines[stage], self.end - seconds * reserve)
+
+    def deadline(self, stage):
+        return self.deadlines[stage]
+
+    def stage_done(self, stage):
+        """
+        Re-spreads the time left over the stages after `stage`, in their
+        planned proportions. A later deadline only ever moves later.
+        """
+        now = time.monotonic()
+        done = self.fractions[stage]
+        if done >= 1:
+            return
+        for later, fraction in self.fractions.items():
+            if fraction > done:
+                respread = now + (self.end - now) * (fraction - done) / (1 - done)
+                self.deadlines[later] = max(self.deadlines[later], respread)
+
+    def elapsed(self):
+        return time.monotonic() - self.start
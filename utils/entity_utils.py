@@ -1,44 +1,121 @@
 # utils/entity_utils.py (Refined Prompt and Debugging)
 import os
-import google.generativeai as genai
+import re
+import logging
 from dotenv import load_dotenv
 import json
-import time
-import random
+from utils import db_utils
+from utils.cache_utils import LRUCache
+from utils.gemini_utils import generate_content
+from utils.metrics_utils import timed
 
 load_dotenv()
 
-def make_api_call_with_retry(model, prompt, max_retries=5):
+logger = logging.getLogger(__name__)
+
+# Tier 1: recent extractions, keyed by the normalized query
+ENTITY_CACHE_TTL = int(os.environ.get("ENTITY_CACHE_TTL", 24 * 3600))
+_entity_cache = LRUCache(maxsize=5000, ttl=ENTITY_CACHE_TTL, name="entity")
+
+# Tier 2: local parser for lists of places we have resolved before.
+# Separators are captured so a name containing one ("Barnes & Noble") can be
+# put back together.
+_SEPARATORS = re.compile(r"(\s*(?:,|;|&|\+|\band then\b|\bthen\b|\band\b|\bfollowed by\b|\bafter that\b)\s*)", re.IGNORECASE)
+_LEADING_FILLER = re.compile(
+    r"^(?:(?:i|we)(?:'m| am| are)? (?:want|wanna|plan|planning|would like|'d like|will|might)(?: to)?\s+)?"
+    r"(?:(?:on\s+)?(?:saturday|sunday)(?:\s+(?:morning|afternoon|evening|night))?\s+)?"
+    r"(?:(?:go|going|head|visit|visiting|see|check out|stop)\s+)?(?:(?:to|at|by)\s+)?"
+    r"(?:(?:a\s+)?(?:hike|hiking|walk|lunch|dinner|breakfast|brunch|drinks|coffee|picnic|shopping)\s+(?:at|in|on)\s+)?"
+    r"(?:the\s+)?",
+    re.IGNORECASE,
+)
+_MAX_PARTS = 12  # Separator-delimited parts; longer queries go to Gemini
+_TRAILING_FILLER = re.compile(
+    r"\s+(?:(?:for|to)\s+)?(?:a\s+)?(?:hike|hiking|walk|lunch|dinner|breakfast|brunch|drinks|coffee|trip|visit|tour|picnic|shopping)$",
+    re.IGNORECASE,
+)
+def _strip_filler(text):
+    return _TRAILING_FILLER.sub("", _LEADING_FILLER.sub("", text.strip())).strip()
+
+
+def parse_entities_locally(query):
     """
-    Makes an API call with exponential backoff for rate limiting.
+    Cheap parser for queries that are just a list of known places, like
+    "Central Park and Cheesecake Factory".
+
+    Only answers when the whole query, or every piece of one way of splitting
+    it at the separators, is a query the place store has resolved before.
+    Pieces may span separators, so "Barnes & Noble and Central Park" stays
+    ["Barnes & Noble", "Central Park"] once both are known. Returns None
+    otherwise, so the caller falls back to Gemini.
     """
-    retries = 0
-    delay = 1  # Initial delay in seconds
-
-    while retries < max_retries:
-        try:
-            response = model.generate_content(prompt)
-            return response.text  # Success!
-        except Exception as e:
-            if "ResourceExhausted" in str(e) or "429" in str(e):  # Check for rate limit
-                retries += 1
-                wait_time = delay * (2 ** retries) + random.uniform(0, 1)  # Exponential backoff + jitter
-                print(f"Rate limited. Retrying in {wait_time:.2f} seconds...")
-                time.sleep(wait_time)
+    query = (query or "").strip().rstrip(".!?")
+    if not query or len(query) > 200:
+        return None
+
+    pieces = _SEPARATORS.split(query)  # [part, separator, part, ...]
+    parts, separators = pieces[0::2], pieces[1::2]
+    if len(parts) > _MAX_PARTS:
+        return None
+
+    resolved = {}
+
+    def known(i, j):
+        """Parts i..j joined with their separators, filler stripped, if the store knows it."""
+        if (i, j) not in resolved:
+            text = parts[i] + "".join(separators[k] + parts[k + 1] for k in range(i, j))
+            text = _strip_filler(text)
+            resolved[i, j] = text if text and db_utils.get_place_id_for_query(text) else None
+        return resolved[i, j]
+
+    # splits[j]: the fewest known names covering parts[:j], or None
+    splits = [[]] + [None] * len(parts)
+    for j in range(1, len(parts) + 1):
+        for i in range(j):
+            if splits[i] is None:
+                continue
+            if not _strip_filler(parts[i]) and i == j - 1:
+                candidate = splits[i]  # Empty part, e.g. a trailing comma
             else:
-                print(f"Other error: {type(e).__name__}: {e}")
-                return None  # Non-rate-limit error
+                name = known(i, j - 1)
+                if name is None:
+                    continue
+                candidate = splits[i] + [name]
+            if splits[j] is None or len(candidate) < len(splits[j]):
+                splits[j] = candidate
 
-    print(f"Max retries exceeded.")
-    return None
+    entities = splits[-1]
+    return list(dict.fromkeys(entities)) if entities else None  # Dedupe, keep order
 
-def extract_entities_with_gemini(query):
+
+@timed("entity_extraction")
+def extract_entities_with_gemini(query, deadline=None):
     """
-    Extracts place entities using the Gemini API (with a refined prompt).
+    Extracts place entities from a query, trying the cheap tiers first:
+    the entity cache, then the local parser, and only then Gemini.
     """
-    genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
-    model = genai.GenerativeModel('gemini-pro')
+    cache_key = db_utils.normalize_query(query)
+    cached = _entity_cache.get(cache_key)
+    if cached is not None:
+        logger.debug("Entity cache hit for: %s", query)
+        return list(cached)
+
+    entities = parse_entities_locally(query)
+    if entities is not None:
+        # Not cached: the store already answers this cheaply, and stays current
+        logger.debug("Locally parsed entities: %s", entities)
+        return entities
+
+    entities = _extract_entities_gemini(query, deadline)
+    if entities:  # Don't cache failures/empty answers, they may be transient
+        _entity_cache.set(cache_key, list(entities))
+    return entities
 
+
+def _extract_entities_gemini(query, deadline=None):
+    """
+    Extracts place entities using the Gemini API (with a refined prompt).
+    """
     prompt = f"""Extract all distinct named places and locations from the following user query.
 The user is describing their plans for the weekend.
 
@@ -69,26 +146,26 @@ User Query: 'mori point hike and then cheesecake factory for lunch'
 Begin!
 """
 
-    print(f"DEBUG: Gemini Prompt for Entity Extraction:\n{prompt}") # PRINT THE PROMPT
+    logger.debug("Gemini prompt for entity extraction:\n%s", prompt)
 
     try:
-        response_text = make_api_call_with_retry(model, prompt)
-        print(f"DEBUG: Gemini Raw Response: {response_text}")  # PRINT RAW RESPONSE
+        response_text = generate_content(prompt, deadline=deadline)
+        logger.debug("Gemini raw response: %s", response_text)
 
         if response_text:
             try:
                 entities = json.loads(response_text)
-                print(f"DEBUG: Parsed Entities: {entities}") # PRINT PARSED
+                logger.debug("Parsed entities: %s", entities)
                 if isinstance(entities, list):
                     return entities
                 else:
-                    print(f"DEBUG: Gemini returned a non-list: {entities}")
+                    logger.warning("Gemini returned a non-list: %s", entities)
                     return []
             except json.JSONDecodeError:
-                print(f"DEBUG: Could not parse Gemini response as JSON: {response_text}")
+                logger.warning("Could not parse Gemini response as JSON: %s", response_text)
                 return []
         else:
             return []
     except Exception as e:
-        print(f"Error extracting entities with Gemini: {type(e).__name__}: {e}")
+        logger.error("Error extracting entities with Gemini: %s: %s", type(e).__name__, e)
         return []
\ No newline at end of file
@@ -1,45 +1,168 @@
 # utils/gemini_utils.py
 import os
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from dotenv import load_dotenv
 import time
 import random
+import logging
+import threading
+from utils.rate_limit_utils import TokenBucket, CircuitBreaker
+from utils.metrics_utils import timed, record_upstream_call
 
 load_dotenv()
 
-def make_api_call_with_retry(model, prompt, max_retries=5):
+logger = logging.getLogger(__name__)
+
+# --- Shared Gemini client ---
+# Every Gemini call in the app (entity extraction, trip reviews) goes through
+# _call_with_retries() below, so they share one model, one rate limiter, one
+# concurrency cap and one circuit breaker.
+GEMINI_MODEL = 'gemini-pro'
+GEMINI_REQUESTS_PER_SECOND = float(os.environ.get("GEMINI_REQUESTS_PER_SECOND", "1"))  # 60 RPM free tier
+GEMINI_BURST = int(os.environ.get("GEMINI_BURST", "5"))
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "4"))
+# Total time one logical call may spend, including waiting and retries
+GEMINI_REQUEST_BUDGET = float(os.environ.get("GEMINI_REQUEST_BUDGET", "30"))
+GEMINI_MAX_RETRIES = 4
+
+# Errors worth retrying: throttling and transient server-side failures
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+gemini_rate_limiter = TokenBucket(GEMINI_REQUESTS_PER_SECOND, GEMINI_BURST)
+gemini_circuit = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+_concurrency = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """Returns the shared Gemini model, configuring the SDK on first use."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+                _model = genai.GenerativeModel(GEMINI_MODEL)
+    return _model
+
+
+def _call_with_retries(call, call_name, budget=None, deadline=None):
     """
-    Makes an API call with exponential backoff for rate limiting.
+    Runs `call` through the shared limiter, concurrency cap and circuit
+    breaker, and yields the text chunks it returns.
+
+    `call(timeout)` makes one request and returns an iterable of text
+    chunks. Throttling and transient errors are retried with exponential
+    backoff, but only before the first chunk arrives (once text has been
+    yielded, an error ends the output early) and never past the deadline:
+    the time budget covers waiting for a rate token, waiting for a
+    concurrency slot, the request itself and backoff. The concurrency slot
+    is held until the chunks are exhausted or the generator is closed.
+    Yields nothing if the call failed, timed out or the circuit is open.
     """
-    retries = 0
-    delay = 1  # Initial delay in seconds
+    if deadline is None:
+        deadline = time.monotonic() + (budget if budget is not None else GEMINI_REQUEST_BUDGET)
+
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        if not gemini_circuit.allow():
+            logger.warning("Gemini circuit open (recent throttling), failing fast.")
+            return
 
-    while retries < max_retries:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not gemini_rate_limiter.acquire(timeout=remaining):
+            logger.warning("Gemini request budget exhausted waiting for rate limit.")
+            return
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not _concurrency.acquire(timeout=remaining):
+            logger.warning("Gemini request budget exhausted waiting for a free slot.")
+            return
+        yielded = False
         try:
-            response = model.generate_content(prompt)
-            return response.text  # Success!
+            record_upstream_call("gemini", call_name)
+            for text in call(max(deadline - time.monotonic(), 1)):
+                if text:
+                    if not yielded:
+                        gemini_circuit.record_success()
+                    yielded = True
+                    yield text
+            if not yielded:
+                gemini_circuit.record_success()
+            return
+        except RETRYABLE_ERRORS as e:
+            gemini_circuit.record_failure()
+            if yielded:
+                logger.warning("Gemini stream interrupted: %s: %s", type(e).__name__, e)
+                return
+            if attempt == GEMINI_MAX_RETRIES:
+                break  # No retry left, so no point backing off
+            wait_time = (2 ** attempt) + random.uniform(0, 1)  # Exponential backoff + jitter
+            if time.monotonic() + wait_time >= deadline:
+                logger.warning("Gemini %s; not enough budget left to retry.", type(e).__name__)
+                return
+            logger.info("Gemini %s. Retrying in %.2f seconds...", type(e).__name__, wait_time)
         except Exception as e:
-            if "ResourceExhausted" in str(e) or "429" in str(e):  # Check for rate limit
-                retries += 1
-                wait_time = delay * (2 ** retries) + random.uniform(0, 1)  # Exponential backoff + jitter
-                print(f"Rate limited. Retrying in {wait_time:.2f} seconds...")
-                time.sleep(wait_time)
-            else:
-                print(f"Other error: {type(e).__name__}: {e}")
-                return None  # Non-rate-limit error
+            gemini_circuit.record_success()  # The API answered; this isn't throttling
+            logger.error("Gemini error: %s: %s", type(e).__name__, e)
+            return  # Non-retryable error
+        finally:
+            _concurrency.release()
+        # Back off without holding a concurrency slot, and never past the deadline
+        time.sleep(min(wait_time, max(deadline - time.monotonic(), 0)))
 
-    print(f"Max retries exceeded.")
-    return None
+    logger.warning("Gemini max retries exceeded.")
 
 
-def generate_gemini_review(entities_data, travel_info=None):
+def generate_content(prompt, budget=None, deadline=None):
     """
-    Generates a review using the Gemini model, with improved prompt and error handling.
-    Now expects *summaries* in entities_data.
+    Calls Gemini through the shared limiter, concurrency cap and circuit
+    breaker, retrying within the time budget (see _call_with_retries).
+
+    Args:
+        prompt: The prompt text.
+        budget: Seconds this call may take in total (default GEMINI_REQUEST_BUDGET).
+        deadline: Absolute time.monotonic() deadline; overrides `budget`.
+
+    Returns:
+        The response text, or None if the call failed, timed out or the
+        circuit is open.
+    """
+    def call(timeout):
+        response = get_model().generate_content(prompt, request_options={'timeout': timeout})
+        return [response.text]  # Raises if the response was blocked
+
+    # Exhausting the generator releases the concurrency slot right away
+    return "".join(_call_with_retries(call, "generate_content", budget, deadline)) or None
+
+
+def generate_content_stream(prompt, budget=None, deadline=None):
+    """
+    Streaming counterpart of generate_content(): yields text chunks as Gemini
+    produces them. Retries only happen before the first chunk arrives.
     """
-    genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
-    model = genai.GenerativeModel('gemini-pro')
+    def call(timeout):
+        response = get_model().generate_content(prompt, stream=True, request_options={'timeout': timeout})
+        return (chunk.text for chunk in response)
 
+    yield from _call_with_retries(call, "generate_content_stream", budget, deadline)
+
+
+def build_review_prompt(entities_data, travel_info=None, travel_matrix=None):
+    """
+    Builds the trip review prompt. Expects *summaries* in entities_data.
+
+    If travel_matrix (N x N legs from utils.travel_utils.get_travel_matrix) is
+    given, every leg between destinations is included in the prompt;
+    otherwise travel_info describes the first two destinations only.
+    """
     prompt = """You are an expert travel planner specializing in creating concise and informative weekend trip summaries.
 
 Your task is to analyze the provided information and generate a short, helpful review of a user's proposed weekend trip. Focus on the feasibility and overall quality of the plan, considering the provided review *summaries*, weather, and (if available) travel time between locations.
@@ -65,7 +188,20 @@ Your task is to analyze the provided information and generate a short, helpful r
         else:
             prompt += "- No weather data available.\n"
 
-    if travel_info and len(entities_data) > 1:
+    travel_legs = []
+    if travel_matrix and len(entities_data) > 1:
+        for i, row in enumerate(travel_matrix):
+            for j, leg in enumerate(row):
+                if leg and i < j:
+                    travel_legs.append((i, j, leg))
+
+    if travel_legs:
+        prompt += "\n**Travel Information (between destinations):**\n"
+        for i, j, leg in travel_legs:
+            mode = leg.get('mode', 'driving')
+            estimate = " (estimated, short walk)" if leg.get('estimated') else ""
+            prompt += f"- {entities_data[i]['name']} to {entities_data[j]['name']}: Distance: {leg.get('distance', 'N/A')}, Duration: {leg.get('duration', 'N/A')} by {mode}{estimate}\n"
+    elif travel_info and len(entities_data) > 1:
         prompt += f"\n**Travel Information (between {entities_data[0]['name']} and {entities_data[1]['name']}):**\n"
         prompt += f"- Distance: {travel_info.get('distance', 'N/A')}\n"
         prompt += f"- Duration: {travel_info.get('duration', 'N/A')}\n"
@@ -111,11 +247,36 @@ Give your response in the following format.
 
 **Rating:** ⭐⭐⭐⭐ (Example - out of 5 stars)
 """
+    return prompt
+
+
+@timed("review_generation")
+def generate_gemini_review(entities_data, travel_info=None, travel_matrix=None, deadline=None):
+    """
+    Generates a review using the Gemini model, with improved prompt and error handling.
+    Now expects *summaries* in entities_data.
+    """
+    prompt = build_review_prompt(entities_data, travel_info, travel_matrix)
 
     try:
-        # Use the retry function
-        review_text = make_api_call_with_retry(model, prompt)
+        # Shared client: rate limited, deadline-aware retries, circuit breaker
+        review_text = generate_content(prompt, deadline=deadline)
         return review_text
     except Exception as e:
-        print(f"Error generating Gemini review: {type(e).__name__}: {e}")
-        return None
\ No newline at end of file
+        logger.error("Error generating Gemini review: %s: %s", type(e).__name__, e)
+        return None
+
+
+@timed("review_generation")
+def generate_gemini_review_stream(entities_data, travel_info=None, travel_matrix=None, deadline=None):
+    """
+    Streaming version of generate_gemini_review(): returns an iterator of
+    markdown text chunks. Yields nothing if the review could not be generated.
+    """
+    prompt = build_review_prompt(entities_data, travel_info, travel_matrix)
+
+    try:
+        for chunk in generate_content_stream(prompt, deadline=deadline):
+            yield chunk
+    except Exception as e:
+        logger.error("Error streaming Gemini review: %s: %s", type(e).__name__, e)
\ No newline at end of file
@@ -0,0 +1,293 @@
+# utils/inference_utils.py
+"""
+Local inference server for the NLP models in utils/nlp_utils.py.
+
+With one gunicorn worker, every concurrent /search runs Flair and the
+summarizer under the same GIL, and adding workers would load the
+multi-gigabyte models once per worker. Instead, one server process owns the
+models and the web workers talk to it over a Unix socket.
+
+Concurrent requests are coalesced into dynamic micro-batches. A batch goes to
+the model once it holds INFERENCE_MAX_BATCH texts, or INFERENCE_MAX_WAIT_MS
+after its first request arrived, whichever comes first.
+
+Run the server with:
+    python -m utils.inference_utils
+and point the web workers at it with INFERENCE_SOCKET (main.py falls back to
+in-process models when it is unset).
+"""
+import os
+import time
+import queue
+import logging
+import argparse
+import threading
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+from utils import nlp_utils
+from utils.metrics_utils import timed
+from utils.singleflight_utils import single_flight
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_SOCKET = os.environ.get("INFERENCE_SOCKET")
+INFERENCE_MAX_WAIT_MS = float(os.environ.get("INFERENCE_MAX_WAIT_MS", "15"))
+INFERENCE_MAX_BATCH = int(os.environ.get("INFERENCE_MAX_BATCH", "64"))  # Texts / summary requests per batch
+INFERENCE_TIMEOUT = float(os.environ.get("INFERENCE_TIMEOUT", "120"))  # Seconds a client waits for an answer
+
+
+# --- Server side ---
+
+class MicroBatcher:
+    """
+    Coalesces concurrent submit() calls into one `run_batch` call.
+
+    `run_batch` takes a list of payloads and returns a list of results in
+    the same order. A worker thread collects payloads for up to `max_wait`
+    seconds after the first one arrives, or until their combined size
+    reaches `max_size`, then runs them together.
+    """
+
+    def __init__(self, name, run_batch, max_wait=INFERENCE_MAX_WAIT_MS / 1000.0, max_size=INFERENCE_MAX_BATCH):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_wait = max_wait
+        self.max_size = max_size
+        self._queue = queue.Queue()
+        self._running = 0
+        self._thread = threading.Thread(target=self._loop, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """Calls queued or running right now."""
+        return self._queue.qsize() + self._running
+
+    def submit(self, payload, size=1):
+        """Queues one payload and blocks until its result is ready."""
+        future = Future()
+        self._queue.put((payload, size, future))
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        size = batch[0][1]
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += item[1]
+        return batch, size
+
+    def _loop(self):
+        while True:
+            batch, size = self._collect()
+            self._running = len(batch)
+            logger.debug("%s batch: %d calls, size %d", self.name, len(batch), size)
+            try:
+                results = self.run_batch([payload for payload, _, _ in batch])
+                for (_, _, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+            finally:
+                self._running = 0
+
+
+def _split(flat, lengths):
+    results, start = [], 0
+    for length in lengths:
+        results.append(flat[start:start + length])
+        start += length
+    return results
+
+
+def _run_sentiment_batch(payloads):
+    """payloads: lists of texts. One Flair pass over all of them."""
+    flat = [text for texts in payloads for text in texts]
+    return _split(nlp_utils.analyze_sentiment_batch(flat), [len(texts) for texts in payloads])
+
+
+def _run_summary_batch(payloads):
+    """
+    payloads: (requests, max_length, min_length). Calls with the same length
+    limits share one summarizer pass.
+    """
+    results = [None] * len(payloads)
+    groups = {}
+    for i, (_, max_length, min_length) in enumerate(payloads):
+        groups.setdefault((max_length, min_length), []).append(i)
+    for (max_length, min_length), indexes in groups.items():
+        flat = [request for i in indexes for request in payloads[i][0]]
+        summaries = nlp_utils.summarize_reviews_batch(flat, max_length=max_length, min_length=min_length,
+                                                      mode="abstractive")
+        for i, chunk in zip(indexes, _split(summaries, [len(payloads[i][0]) for i in indexes])):
+            results[i] = chunk
+    return results
+
+
+class InferenceServer:
+    """
+    Serves nlp_utils over a Unix socket, one thread per client connection,
+    with a MicroBatcher per model in front of the models.
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.sentiment = MicroBatcher("sentiment", _run_sentiment_batch)
+        self.summaries = MicroBatcher("summarization", _run_summary_batch)
+
+    def handle(self, op, payload):
+        if op == "sentiment":
+            return self.sentiment.submit(payload, size=len(payload)) if payload else []
+        if op == "summarize":
+            requests, max_length, min_length, mode, remaining = payload
+            if not requests:
+                return []
+            deadline = None if remaining is None else time.monotonic() + remaining
+            if nlp_utils.choose_summary_mode(len(requests), mode, deadline, queued=self.summaries.pending) == "extractive":
+                return nlp_utils.summarize_reviews_batch(requests, max_length, min_length, mode="extractive")
+            return self.summaries.submit((requests, max_length, min_length), size=len(requests))
+        if op == "status":
+            return {'ready': nlp_utils.models_ready(), 'models': nlp_utils.models_status()}
+        raise ValueError(f"Unknown inference op: {op}")
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    op, payload = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    conn.send(("ok", self.handle(op, payload)))
+                except Exception as e:
+                    logger.exception("Inference %s failed", op)
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # Left over from a previous run
+        with Listener(self.socket_path, family="AF_UNIX") as listener:
+            logger.info("Inference server listening on %s", self.socket_path)
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+
+# --- Client side (web workers) ---
+
+class InferenceError(RuntimeError):
+    pass
+
+
+_local = threading.local()
+
+
+def _connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = Client(INFERENCE_SOCKET, family="AF_UNIX")
+    return conn
+
+
+def _drop_connection():
+    conn = getattr(_local, "conn", None)
+    _local.conn = None
+    if conn is not None:
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+
+def _call(op, payload, timeout=INFERENCE_TIMEOUT):
+    """
+    Sends one request on this thread's connection (reconnecting once if the
+    server restarted) and waits for the answer.
+    """
+    for attempt in range(2):
+        try:
+            conn = _connection()
+            conn.send((op, payload))
+            if not conn.poll(timeout):
+                _drop_connection()  # A late answer would desync the connection
+                raise InferenceError(f"Inference server did not answer {op} within {timeout}s")
+            status, result = conn.recv()
+            break
+        except (EOFError, OSError) as e:
+            _drop_connection()
+            if attempt:
+                raise InferenceError(f"Inference server unreachable: {type(e).__name__}: {e}") from e
+    if status != "ok":
+        raise InferenceError(result)
+    return result
+
+
+@timed("sentiment")
+@single_flight("sentiment", key=nlp_utils.sentiment_batch_key, timeout=INFERENCE_TIMEOUT)
+def analyze_sentiment_batch(texts, mini_batch_size=32):
+    """Same contract as nlp_utils.analyze_sentiment_batch, served remotely."""
+    if not texts:
+        return []
+    return _call("sentiment", list(texts))
+
+
+@timed("summarization")
+@single_flight("summarization", timeout=INFERENCE_TIMEOUT,
+               key=lambda requests, max_length=130, min_length=30, mode=None, deadline=None:
+               nlp_utils.summary_batch_key(requests, max_length, min_length, mode=mode))
+def summarize_reviews_batch(requests, max_length=130, min_length=30, mode=None, deadline=None):
+    """
+    Same contract as nlp_utils.summarize_reviews_batch, served remotely.
+    Extractive summaries need no model, so they are computed right here, and
+    in "auto" mode a late or unreachable server degrades to them too.
+    """
+    if not requests:
+        return []
+    mode = mode or nlp_utils.SUMMARY_MODE
+    if mode == "extractive":
+        return nlp_utils.summarize_reviews_batch(requests, max_length, min_length, mode="extractive")
+
+    remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+    timeout = INFERENCE_TIMEOUT if remaining is None else min(INFERENCE_TIMEOUT, remaining)
+    try:
+        return _call("summarize", (list(requests), max_length, min_length, mode, remaining), timeout=timeout)
+    except InferenceError as e:
+        if mode == "auto":
+            logger.warning("Abstractive summaries unavailable (%s), using extractive summaries", e)
+            return nlp_utils.summarize_reviews_batch(requests, max_length, min_length, mode="extractive")
+        logger.error("Error during summarization: %s", e)
+        return [f"Error generating {sentiment_category} summary." for _, sentiment_category in requests]
+
+
+def models_status():
+    try:
+        return _call("status", None, timeout=2)['models']
+    except InferenceError as e:
+        return {'error': str(e)}
+
+
+def models_ready():
+    try:
+        return _call("status", None, timeout=2)['ready']
+    except InferenceError:
+        return False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the NLP models to the web workers.")
+    parser.add_argument("--socket", default=INFERENCE_SOCKET or "/tmp/weekend_fun_rater_inference.sock")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    nlp_utils.start_warm_up()  # Accept connections (and report "loading") while the models load
+    InferenceServer(args.socket).serve_forever()
@@ -0,0 +1,137 @@
+# utils/metrics_utils.py
+import time
+import logging
+import inspect
+import functools
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from cache hits up to slow Gemini/Reddit calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_SECONDS = "wfr_stage_duration_seconds"
+REQUEST_SECONDS = "wfr_http_request_duration_seconds"
+CACHE_LOOKUPS = "wfr_cache_lookups_total"
+UPSTREAM_CALLS = "wfr_upstream_calls_total"
+COALESCED_CALLS = "wfr_coalesced_calls_total"
+
+_HELP = {
+    STAGE_SECONDS: ("histogram", "Time spent in each /search pipeline stage."),
+    REQUEST_SECONDS: ("histogram", "HTTP request latency by route and status."),
+    CACHE_LOOKUPS: ("counter", "Cache lookups by cache and result (hit/miss)."),
+    UPSTREAM_CALLS: ("counter", "Outbound API calls by provider and call."),
+    COALESCED_CALLS: ("counter", "Single-flight calls by function and role (leader/waiter/timeout/late)."),
+}
+
+_lock = threading.Lock()
+_counters = {}    # name -> {label tuple: value}
+_histograms = {}  # name -> {label tuple: [bucket counts..., sum, count]}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """Adds `amount` to a counter."""
+    key = _label_key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + amount
+
+
+def counter_total(name, **labels):
+    """Sum of a counter over every series whose labels include `labels`."""
+    wanted = set(labels.items())
+    with _lock:
+        return sum(value for key, value in _counters.get(name, {}).items() if wanted <= set(key))
+
+
+def observe(name, value, **labels):
+    """Records one observation in a histogram."""
+    key = _label_key(labels)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        state = series.get(key)
+        if state is None:
+            state = series[key] = [0] * len(DEFAULT_BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+
+
+@contextmanager
+def span(stage):
+    """Times the enclosed block as one observation of `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe(STAGE_SECONDS, elapsed, stage=stage)
+        logger.debug("stage %s took %.3fs", stage, elapsed)
+
+
+def timed(stage):
+    """
+    Decorator form of span(). Generator functions are timed until the
+    generator is exhausted or closed.
+    """
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                with span(stage):
+                    yield from func(*args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_cache(cache, hit, count=1):
+    """Counts `count` lookups in `cache` as hits or misses."""
+    if count:
+        inc(CACHE_LOOKUPS, count, cache=cache, result="hit" if hit else "miss")
+
+
+def record_upstream_call(provider, call):
+    """Counts one outbound API call."""
+    inc(UPSTREAM_CALLS, provider=provider, call=call)
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = ['{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+               for k, v in pairs]
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_prometheus():
+    """Returns every metric in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        names = sorted(set(_counters) | set(_histograms))
+        for name in names:
+            metric_type, help_text = _HELP.get(name, ("counter" if name in _counters else "histogram", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for key, value in sorted(_counters.get(name, {}).items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+            for key, state in sorted(_histograms.get(name, {}).items()):
+                for bound, bucket_count in zip(DEFAULT_BUCKETS, state):
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {bucket_count}")
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {state[-1]}")
+                lines.append(f"{name}_sum{_format_labels(key)} {state[-2]}")
+                lines.append(f"{name}_count{_format_labels(key)} {state[-1]}")
+    return "\n".join(lines) + "\n"
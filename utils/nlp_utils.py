@@ -1,49 +1,313 @@
 # utils/nlp_utils.py
-from flair.models import TextClassifier
-from flair.data import Sentence
-from transformers import pipeline
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from utils import db_utils
+from utils.cache_utils import LRUCache
+from utils.metrics_utils import timed, record_cache
+from utils.singleflight_utils import single_flight
 
-# Load the Flair sentiment classifier (downloads automatically the first time)
-classifier = TextClassifier.load('en-sentiment')
+logger = logging.getLogger(__name__)
 
-# Initialize the Hugging Face summarizer (downloads the model the first time)
-summarizer = pipeline("summarization")
+SENTIMENT_MODEL = 'en-sentiment'
+# The checkpoint pipeline("summarization") picks by default, pinned so the
+# ONNX export and the PyTorch backends run the same weights.
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL", "sshleifer/distilbart-cnn-12-6")
 
-def analyze_sentiment(text):
+# Inference backend, for CPU-only instances:
+#   torch     - fp32 PyTorch models (the reference)
+#   quantized - dynamic int8 quantization of the Linear layers of both models
+#   onnx      - summarizer exported to ONNX Runtime (needs optimum[onnxruntime]),
+#               classifier int8-quantized as above
+# Check a backend against "torch" with `python -m benchmarks.nlp_parity`.
+NLP_BACKENDS = ("torch", "quantized", "onnx")
+NLP_BACKEND = os.environ.get("NLP_BACKEND", "torch").lower()
+if NLP_BACKEND not in NLP_BACKENDS:
+    raise ValueError(f"NLP_BACKEND must be one of {NLP_BACKENDS}, got {NLP_BACKEND!r}")
+# Exported ONNX models are cached here so the export only happens once
+NLP_ONNX_DIR = os.environ.get("NLP_ONNX_DIR", os.path.join(tempfile.gettempdir(), "weekend_fun_rater_onnx"))
+
+# The Flair classifier and the Hugging Face summarizer pull in torch and take
+# tens of seconds to build, so they are loaded lazily (or by warm_up() in a
+# background thread) instead of at import time.
+_classifier = None
+_summarizer = None
+_model_lock = threading.Lock()
+_ready = threading.Event()
+_warm_up_error = None
+
+def _quantize_dynamic(model):
     """
-    Analyzes the sentiment of a review text using Flair.
+    Returns `model` with its Linear layers converted to dynamic int8
+    (weights quantized once, activations per batch). CPU only.
+    """
+    import torch
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
 
-    Args:
-        text: The review text.
+def load_classifier(backend=None):
+    """
+    Builds a Flair sentiment classifier for `backend` (default NLP_BACKEND).
+    """
+    backend = backend or NLP_BACKEND
+    from flair.models import TextClassifier
+    # Downloads automatically the first time
+    classifier = TextClassifier.load(SENTIMENT_MODEL)
+    if backend in ("quantized", "onnx"):
+        classifier = _quantize_dynamic(classifier)
+    classifier.eval()
+    return classifier
 
-    Returns:
-        A string representing the sentiment.
+def _load_onnx_summarizer():
+    try:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    except ImportError as e:
+        raise RuntimeError("NLP_BACKEND=onnx needs the optimum[onnxruntime] package") from e
+    from transformers import AutoTokenizer, pipeline
+
+    export_dir = os.path.join(NLP_ONNX_DIR, SUMMARY_MODEL.replace("/", "--"))
+    if os.path.isdir(export_dir):
+        model = ORTModelForSeq2SeqLM.from_pretrained(export_dir)
+    else:
+        logger.info("Exporting %s to ONNX in %s", SUMMARY_MODEL, export_dir)
+        model = ORTModelForSeq2SeqLM.from_pretrained(SUMMARY_MODEL, export=True)
+        model.save_pretrained(export_dir)
+    tokenizer = AutoTokenizer.from_pretrained(SUMMARY_MODEL)
+    return pipeline("summarization", model=model, tokenizer=tokenizer)
+
+def load_summarizer(backend=None):
     """
-    sentence = Sentence(text)
-    classifier.predict(sentence)
-    label = sentence.labels[0]  # Get the top label (e.g., 'POSITIVE', 'NEGATIVE')
-    score = sentence.labels[0].score  # Get the confidence score
+    Builds a Hugging Face summarization pipeline for `backend` (default NLP_BACKEND).
+    """
+    backend = backend or NLP_BACKEND
+    if backend == "onnx":
+        return _load_onnx_summarizer()
+    from transformers import pipeline
+    # Downloads the model the first time
+    summarizer = pipeline("summarization", model=SUMMARY_MODEL)
+    if backend == "quantized":
+        summarizer.model = _quantize_dynamic(summarizer.model)
+    return summarizer
+
+def get_classifier():
+    """
+    Returns the Flair sentiment classifier, loading it on first use.
+    """
+    global _classifier
+    if _classifier is None:
+        with _model_lock:
+            if _classifier is None:
+                _classifier = load_classifier()
+    return _classifier
+
+def get_summarizer():
+    """
+    Returns the Hugging Face summarization pipeline, loading it on first use.
+    """
+    global _summarizer
+    if _summarizer is None:
+        with _model_lock:
+            if _summarizer is None:
+                _summarizer = load_summarizer()
+    return _summarizer
+
+def warm_up():
+    """
+    Loads both models. Meant to run in a background thread at worker start.
+    """
+    global _warm_up_error
+    try:
+        get_classifier()
+        get_summarizer()
+        _ready.set()
+        logger.info("NLP models loaded")
+    except Exception as e:
+        _warm_up_error = f"{type(e).__name__}: {e}"
+        logger.error("Error loading NLP models: %s", _warm_up_error)
 
+def start_warm_up():
+    """
+    Starts warm_up() in a daemon thread so the worker can serve requests right away.
+    """
+    thread = threading.Thread(target=warm_up, name="nlp-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def models_ready():
+    """
+    Returns True once both models are loaded.
+    """
+    return _ready.is_set() or (_classifier is not None and _summarizer is not None)
+
+def models_status():
+    """
+    Returns a small dict describing model load state, for the readiness probe.
+    """
+    return {
+        'backend': NLP_BACKEND,
+        'sentiment': _classifier is not None,
+        'summarizer': _summarizer is not None,
+        'error': _warm_up_error,
+    }
+
+def _label_to_sentiment(label):
+    """
+    Maps a Flair label (value + confidence score) to our sentiment categories.
+    """
     if label.value == 'POSITIVE':
-        if score > 0.9:
+        if label.score > 0.9:
             return 'Highly Positive'
         else:
             return 'Positive'
     elif label.value == 'NEGATIVE':
-        if score > 0.9:
+        if label.score > 0.9:
             return 'Highly Negative'
         else:
             return 'Negative'
     else:
         return 'Neutral' # Should not happen with en-sentiment, but good practice
 
-def summarize_reviews(reviews, sentiment_category, max_length=130, min_length=30):
+def analyze_sentiment(text):
+    """
+    Analyzes the sentiment of a review text using Flair.
+
+    Args:
+        text: The review text.
+
+    Returns:
+        A string representing the sentiment.
+    """
+    from flair.data import Sentence
+
+    sentence = Sentence(text)
+    get_classifier().predict(sentence)
+    return _label_to_sentiment(sentence.labels[0])  # Top label (e.g., 'POSITIVE', 'NEGATIVE')
+
+# Identical concurrent model calls (e.g. many searches for one trending place)
+# are coalesced; they run much longer than the upstream calls
+MODEL_FLIGHT_TIMEOUT = 120
+
+def sentiment_batch_key(texts, mini_batch_size=32, classifier=None):
+    """
+    Single-flight key for analyze_sentiment_batch: a hash of the texts, or
+    None (no coalescing) with a custom classifier.
+    """
+    if classifier is not None or not texts:
+        return None
+    return hashlib.sha256("\0".join(text or "" for text in texts).encode("utf-8")).hexdigest()
+
+@timed("sentiment")
+@single_flight("sentiment", key=sentiment_batch_key, timeout=MODEL_FLIGHT_TIMEOUT)
+def analyze_sentiment_batch(texts, mini_batch_size=32, classifier=None):
+    """
+    Analyzes the sentiment of many review texts with batched Flair inference.
+
+    Texts are sorted by length before batching so each mini-batch pads to a
+    similar size, then the results are put back in input order.
+
+    Args:
+        texts: A list of review texts.
+        mini_batch_size: How many sentences go through the model per forward pass.
+        classifier: Model to use instead of the shared one (see load_classifier()).
+
+    Returns:
+        A list of sentiment strings, one per input text (same order).
+    """
+    if not texts:
+        return []
+
+    from flair.data import Sentence
+
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i] or ""))
+    sentences = [Sentence(texts[i] or "") for i in order]
+    (classifier or get_classifier()).predict(sentences, mini_batch_size=mini_batch_size)
+
+    sentiments = [None] * len(texts)
+    for i, sentence in zip(order, sentences):
+        if sentence.labels:
+            sentiments[i] = _label_to_sentiment(sentence.labels[0])
+        else:
+            sentiments[i] = 'Neutral'  # Empty text gets no label
+    return sentiments
+
+# --- Sentiment cache ---
+# Labels are keyed by a hash of the normalized review text plus the model id,
+# so the same Google/Reddit review is only ever run through Flair once. The
+# in-memory LRU is per worker; the SQLite tier (db_utils) survives restarts
+# and can be turned off with SENTIMENT_DISK_CACHE=0.
+SENTIMENT_CACHE_SIZE = int(os.environ.get("SENTIMENT_CACHE_SIZE", "10000"))
+SENTIMENT_DISK_CACHE = os.environ.get("SENTIMENT_DISK_CACHE", "1") != "0"
+# The int8 classifier can disagree with fp32 near the 0.9 confidence cut, so
+# its labels are cached under their own id
+SENTIMENT_MODEL_ID = SENTIMENT_MODEL if NLP_BACKEND == "torch" else f"{SENTIMENT_MODEL}+int8"
+_sentiment_cache = LRUCache(maxsize=SENTIMENT_CACHE_SIZE, name="sentiment")
+
+def sentiment_cache_key(text):
+    """
+    Content address for a review: sha256 of the model id and the text with
+    whitespace collapsed.
+    """
+    normalized = " ".join((text or "").split())
+    return hashlib.sha256(f"{SENTIMENT_MODEL_ID}\n{normalized}".encode("utf-8")).hexdigest()
+
+def get_cached_sentiments(texts):
+    """
+    Looks texts up in the memory tier, then the disk tier.
+
+    Returns a list aligned with `texts` holding the cached label, or None for
+    a miss.
+    """
+    keys = [sentiment_cache_key(text) for text in texts]
+    labels = [_sentiment_cache.get(key) for key in keys]
+
+    missing = [key for key, label in zip(keys, labels) if label is None]
+    if missing and SENTIMENT_DISK_CACHE:
+        disk_hits = db_utils.get_cached_sentiments(set(missing))
+        record_cache("sentiment_disk", hit=True, count=len(disk_hits))
+        record_cache("sentiment_disk", hit=False, count=len(set(missing)) - len(disk_hits))
+        for i, key in enumerate(keys):
+            if labels[i] is None and key in disk_hits:
+                labels[i] = disk_hits[key]
+                _sentiment_cache.set(key, labels[i])  # Promote to memory
+    return labels
+
+def cache_sentiments(texts, labels):
     """
-    Summarizes reviews using Hugging Face Transformers.
+    Stores freshly computed labels in both cache tiers.
     """
-    if not reviews:
-        return "No reviews available to summarize."
+    labels_by_key = {}
+    for text, label in zip(texts, labels):
+        key = sentiment_cache_key(text)
+        _sentiment_cache.set(key, label)
+        labels_by_key[key] = label
+    if SENTIMENT_DISK_CACHE:
+        db_utils.save_sentiments(labels_by_key)
+
+# --- Summarization ---
+# Reviews are packed into chunks that fit the summarizer's input window
+# (measured with its own tokenizer), every chunk from every request is
+# summarized in one batched call (map), and requests that produced several
+# partial summaries get a batched reduce pass over them.
+SUMMARY_BATCH_SIZE = int(os.environ.get("SUMMARY_BATCH_SIZE", "8"))
+SUMMARY_MAX_REDUCE_ROUNDS = 3
+
+# Summary tiers: "abstractive" (transformers), "extractive" (sumy LexRank), or
+# "auto", which degrades to extractive when the summarizer is saturated or
+# the caller's deadline is too close.
+SUMMARY_MODES = ("abstractive", "extractive", "auto")
+SUMMARY_MODE = os.environ.get("SUMMARY_MODE", "auto").lower()
+SUMMARY_SENTENCES = int(os.environ.get("SUMMARY_SENTENCES", "3"))
+SUMMARY_MAX_QUEUED = int(os.environ.get("SUMMARY_MAX_QUEUED", "4"))
+# Running estimate of abstractive seconds per summary request (EWMA)
+_seconds_per_summary = float(os.environ.get("SUMMARY_SECONDS_ESTIMATE", "1.5"))
+_abstractive_in_flight = 0
+_estimate_lock = threading.Lock()
 
+def _relevant_review_texts(reviews, sentiment_category):
     relevant_reviews = [
         review['text'] for review in reviews
         if review['sentiment'] in ('Positive', 'Highly Positive')
@@ -54,21 +318,228 @@ def summarize_reviews(reviews, sentiment_category, max_length=130, min_length=30
         if review['sentiment'] in ('Negative', 'Highly Negative')
         and sentiment_category == "Negative"
     ]
+    return [text for text in relevant_reviews if text]
 
-    if not relevant_reviews:
-        return f"No {sentiment_category} reviews to summarize."
+def _token_budget(summarizer):
+    """
+    How many input tokens one summarizer call can take, leaving room for the
+    special tokens the pipeline adds.
+    """
+    limit = getattr(summarizer.model.config, 'max_position_embeddings', None) or 1024
+    model_max = summarizer.tokenizer.model_max_length
+    if model_max and model_max < 100000:  # Some tokenizers report a huge sentinel
+        limit = min(limit, model_max)
+    return limit - summarizer.tokenizer.num_special_tokens_to_add()
+
+def _chunk_texts(texts, tokenizer, budget):
+    """
+    Packs texts, in order, into chunks of at most `budget` tokens. A single
+    text longer than the budget is split on token boundaries.
+    """
+    chunks = []
+    current, current_tokens = [], 0
+    for text in texts:
+        ids = tokenizer(text, add_special_tokens=False)['input_ids']
+        if len(ids) > budget:
+            if current:
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+            for start in range(0, len(ids), budget):
+                chunks.append(tokenizer.decode(ids[start:start + budget], skip_special_tokens=True))
+            continue
+        if current and current_tokens + len(ids) + 1 > budget:
+            chunks.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += len(ids) + 1  # +1 for the joining space
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+def _summarize_chunks(summarizer, chunks, max_length, min_length):
+    """
+    Summarizes many chunks in one batched pipeline call.
+    """
+    outputs = summarizer(chunks, max_length=max_length, min_length=min_length,
+                         truncation=True, batch_size=SUMMARY_BATCH_SIZE)
+    return [output['summary_text'] for output in outputs]
 
-    combined_text = " ".join(relevant_reviews)
+def summary_batch_key(requests, max_length=130, min_length=30, summarizer=None, mode=None, deadline=None):
+    """
+    Single-flight key for summarize_reviews_batch: a hash of what the
+    summaries depend on (labeled review texts, categories, lengths, mode), or
+    None (no coalescing) with a custom summarizer.
+    """
+    if summarizer is not None or not requests:
+        return None
+    content = [[[(review['text'], review.get('sentiment')) for review in reviews], sentiment_category]
+               for reviews, sentiment_category in requests]
+    raw = json.dumps([content, max_length, min_length, mode or SUMMARY_MODE])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+@timed("summarization")
+@single_flight("summarization", key=summary_batch_key, timeout=MODEL_FLIGHT_TIMEOUT)
+def summarize_reviews_batch(requests, max_length=130, min_length=30, summarizer=None, mode=None, deadline=None):
+    """
+    Summarizes several (reviews, sentiment_category) requests together.
+
+    Args:
+        requests: A list of (reviews, sentiment_category) tuples, e.g. the
+            positive and negative summaries for every entity in a search.
+        summarizer: Pipeline to use instead of the shared one (see load_summarizer()).
+        mode: "abstractive", "extractive" or "auto" (default SUMMARY_MODE).
+        deadline: time.monotonic() by which the summaries are needed; "auto"
+            falls back to extractive summaries if that is too soon.
 
+    Returns:
+        A list of summary strings, one per request (same order).
+    """
+    results = [None] * len(requests)
+    pending = {}  # request index -> list of texts still to be summarized
+    for i, (reviews, sentiment_category) in enumerate(requests):
+        if not reviews:
+            results[i] = "No reviews available to summarize."
+            continue
+        relevant_reviews = _relevant_review_texts(reviews, sentiment_category)
+        if not relevant_reviews:
+            results[i] = f"No {sentiment_category} reviews to summarize."
+            continue
+        pending[i] = relevant_reviews
+
+    if not pending:
+        return results
+
+    chosen = choose_summary_mode(len(pending), mode=mode, deadline=deadline, queued=_abstractive_in_flight)
+    if chosen == "extractive":
+        for i, texts in pending.items():
+            results[i] = summarize_extractive(texts)
+    else:
+        _summarize_abstractive(requests, pending, results, max_length, min_length, summarizer)
+
+    for i, (_, sentiment_category) in enumerate(requests):
+        if not results[i]:  # Handle empty summary case
+            results[i] = f"No {sentiment_category} summary available."
+    return results
+
+def _summarize_abstractive(requests, pending, results, max_length, min_length, summarizer=None):
+    """
+    Map-reduce summarization of `pending` ({request index: texts}) with the
+    transformers pipeline, writing into `results`.
+    """
+    global _abstractive_in_flight, _seconds_per_summary
+    with _estimate_lock:
+        _abstractive_in_flight += 1
+    start, request_count = time.monotonic(), len(pending)
     try:
-        summary = summarizer(combined_text, max_length=max_length, min_length=min_length)[0]['summary_text']
-        return summary
-    except IndexError:  # Handle empty summary case
-        return f"No {sentiment_category} summary available."
+        summarizer = summarizer or get_summarizer()
+        budget = _token_budget(summarizer)
+
+        for round_number in range(SUMMARY_MAX_REDUCE_ROUNDS + 1):
+            owners, chunks = [], []
+            for i, texts in pending.items():
+                for chunk in _chunk_texts(texts, summarizer.tokenizer, budget):
+                    owners.append(i)
+                    chunks.append(chunk)
+
+            partials = {}
+            for i, summary in zip(owners, _summarize_chunks(summarizer, chunks, max_length, min_length)):
+                partials.setdefault(i, []).append(summary)
+
+            next_pending = {}
+            for i, summaries in partials.items():
+                if len(summaries) == 1 or round_number == SUMMARY_MAX_REDUCE_ROUNDS:
+                    results[i] = " ".join(summaries)
+                else:
+                    next_pending[i] = summaries  # Reduce the partial summaries
+            pending = next_pending
+            if not pending:
+                break
+
+        with _estimate_lock:
+            observed = (time.monotonic() - start) / request_count
+            _seconds_per_summary = 0.8 * _seconds_per_summary + 0.2 * observed
     except Exception as e:
-        print(f"Error during summarization: {type(e).__name__}: {e}")
-        return f"Error generating {sentiment_category} summary."
+        logger.error("Error during summarization: %s: %s", type(e).__name__, e)
+        for i in pending:
+            results[i] = f"Error generating {requests[i][1]} summary."
+    finally:
+        with _estimate_lock:
+            _abstractive_in_flight -= 1
 
+def summarize_reviews(reviews, sentiment_category, max_length=130, min_length=30, mode=None):
+    """
+    Summarizes reviews using Hugging Face Transformers (or the extractive
+    tier, see SUMMARY_MODE).
+    """
+    return summarize_reviews_batch([(reviews, sentiment_category)], max_length=max_length, min_length=min_length,
+                                   mode=mode)[0]
+
+# --- Extractive tier ---
+# LexRank (sumy) picks the most central review sentences. It needs no model
+# and runs in milliseconds, so it is the fallback when the abstractive
+# pipeline would not finish in time.
+
+class _RegexTokenizer:
+    """
+    Stand-in for sumy's Tokenizer when NLTK's punkt data is not installed.
+    """
+    language = "english"
+    _sentence_end = re.compile(r"(?<=[.!?])\s+")
+    _word = re.compile(r"[\w']+")
+
+    def to_sentences(self, paragraph):
+        return [sentence for sentence in self._sentence_end.split(paragraph.strip()) if sentence]
+
+    def to_words(self, sentence):
+        return self._word.findall(sentence)
+
+_sumy_tokenizer = None
+
+def _get_sumy_tokenizer():
+    global _sumy_tokenizer
+    if _sumy_tokenizer is None:
+        from sumy.nlp.tokenizers import Tokenizer
+        try:
+            _sumy_tokenizer = Tokenizer("english")
+        except LookupError:
+            logger.info("NLTK punkt data not installed, splitting sentences with a regex")
+            _sumy_tokenizer = _RegexTokenizer()
+    return _sumy_tokenizer
+
+def summarize_extractive(texts, sentence_count=None):
+    """
+    Extractive summary of review texts: the `sentence_count` most central
+    sentences by LexRank, in their original order.
+    """
+    from sumy.parsers.plaintext import PlaintextParser
+    from sumy.summarizers.lex_rank import LexRankSummarizer
+
+    sentence_count = sentence_count or SUMMARY_SENTENCES
+    # One review per paragraph, so a review's sentences stay together
+    parser = PlaintextParser.from_string("\n\n".join(texts), _get_sumy_tokenizer())
+    sentences = LexRankSummarizer()(parser.document, sentence_count)
+    return " ".join(str(sentence) for sentence in sentences)
+
+def choose_summary_mode(request_count, mode=None, deadline=None, queued=0):
+    """
+    Resolves "auto" to "abstractive" or "extractive" for `request_count`
+    summaries: extractive when SUMMARY_MAX_QUEUED abstractive calls are
+    already waiting or running, or when the estimated abstractive time would
+    overrun `deadline` (a time.monotonic() value).
+    """
+    mode = mode or SUMMARY_MODE
+    if mode not in SUMMARY_MODES:
+        raise ValueError(f"Summary mode must be one of {SUMMARY_MODES}, got {mode!r}")
+    if mode != "auto":
+        return mode
+    if queued >= SUMMARY_MAX_QUEUED:
+        logger.info("Summarizer saturated (%d queued), using extractive summaries", queued)
+        return "extractive"
+    if deadline is not None and time.monotonic() + request_count * _seconds_per_summary > deadline:
+        logger.info("Abstractive summaries would miss the deadline, using extractive summaries")
+        return "extractive"
+    return "abstractive"
 
 if __name__ == '__main__':
     # --- Test Suite ---
@@ -98,6 +569,13 @@ if __name__ == '__main__':
         print("    PASSED")
 
 
+    print("\n--- Batched Sentiment Analysis Tests ---")
+    batch_sentiments = analyze_sentiment_batch([review['text'] for review in test_reviews])
+    for review, predicted_sentiment in zip(test_reviews, batch_sentiments):
+        assert predicted_sentiment == analyze_sentiment(review['text']), f"Batch mismatch for '{review['text'][:50]}...'"
+    print("    PASSED")
+
+
     print("\n--- Summarization Tests ---")
     positive_summary = summarize_reviews(test_reviews, "Positive")
     print(f"  Positive Summary:\n{positive_summary}")
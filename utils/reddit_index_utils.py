@@ -0,0 +1,213 @@
+# utils/reddit_index_utils.py
+"""
+Local SQLite FTS5 index of Reddit content, so scrape_reddit_reviews can
+answer place queries without live PRAW searches (REDDIT_SOURCE=index).
+
+Load exported subreddit dumps (one JSON object per line, as in the Pushshift
+RS_*/RC_* files: plain, .gz or .zst) with:
+    python -m utils.reddit_index_utils RS_sanfrancisco.zst RC_sanfrancisco.zst
+    python -m utils.reddit_index_utils dumps/*.jsonl --subreddit travel --subreddit sanfrancisco
+
+Submissions are full-text indexed by title and body. Comments are stored only
+if they pass the scraper's review filter (scraping_utils.is_review_text).
+Re-ingesting a file is safe: rows already in the index are skipped.
+"""
+import io
+import os
+import gzip
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import tempfile
+from utils import db_utils
+
+logger = logging.getLogger(__name__)
+
+REDDIT_INDEX_PATH = os.environ.get("REDDIT_INDEX_PATH",
+                                   os.path.join(tempfile.gettempdir(), "weekend_fun_rater_reddit.db"))
+INGEST_BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reddit_submissions (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    subreddit TEXT NOT NULL,
+    title TEXT NOT NULL,
+    selftext TEXT NOT NULL,
+    created_utc REAL
+);
+CREATE INDEX IF NOT EXISTS reddit_submissions_subreddit ON reddit_submissions (subreddit);
+CREATE VIRTUAL TABLE IF NOT EXISTS reddit_submissions_fts USING fts5(
+    title, selftext, content='reddit_submissions', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS reddit_submissions_ai AFTER INSERT ON reddit_submissions BEGIN
+    INSERT INTO reddit_submissions_fts (rowid, title, selftext) VALUES (new.rowid, new.title, new.selftext);
+END;
+CREATE TRIGGER IF NOT EXISTS reddit_submissions_ad AFTER DELETE ON reddit_submissions BEGIN
+    INSERT INTO reddit_submissions_fts (reddit_submissions_fts, rowid, title, selftext)
+    VALUES ('delete', old.rowid, old.title, old.selftext);
+END;
+CREATE TABLE IF NOT EXISTS reddit_comments (
+    id TEXT PRIMARY KEY,
+    submission_id TEXT NOT NULL,
+    subreddit TEXT NOT NULL,
+    body TEXT NOT NULL,
+    author TEXT,
+    score INTEGER,
+    created_utc REAL
+);
+CREATE INDEX IF NOT EXISTS reddit_comments_submission ON reddit_comments (submission_id, score DESC);
+"""
+
+
+def get_connection(path=None):
+    return db_utils.get_connection(path or REDDIT_INDEX_PATH, schema=SCHEMA)
+
+
+def _phrase(text):
+    """FTS5 phrase query for `text`, like the quoted live search."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def search_reviews(place_name, subreddits, max_submissions, max_comments_per_submission, max_reviews, path=None):
+    """
+    Answers a scrape_reddit_reviews query from the index: submissions in each
+    of `subreddits` (in order) whose title or body mention `place_name`, best
+    match first, and their highest-scored review comments. Returns review
+    dicts in the scraper's format; empty if the index has nothing (or does
+    not exist yet).
+    """
+    reviews = []
+    try:
+        conn = get_connection(path)
+        for subreddit in subreddits:
+            submissions = conn.execute(
+                """SELECT s.id FROM reddit_submissions_fts f
+                   JOIN reddit_submissions s ON s.rowid = f.rowid
+                   WHERE reddit_submissions_fts MATCH ? AND s.subreddit = ?
+                   ORDER BY f.rank LIMIT ?""",
+                (_phrase(place_name), subreddit.lower(), max_submissions)
+            ).fetchall()
+            for submission in submissions:
+                for row in conn.execute(
+                    """SELECT body, author, created_utc FROM reddit_comments
+                       WHERE submission_id = ? ORDER BY score DESC LIMIT ?""",
+                    (submission["id"], max_comments_per_submission)
+                ):
+                    reviews.append({
+                        'source': f'Reddit (r/{subreddit})',
+                        'text': row["body"],
+                        'rating': None,
+                        'date': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row["created_utc"] or 0)),
+                        'user': row["author"] or "[deleted]",
+                    })
+                    if len(reviews) >= max_reviews:
+                        return reviews
+    except sqlite3.Error as e:
+        logger.error("Error searching the Reddit index for %s: %s: %s", place_name, type(e).__name__, e)
+    return reviews
+
+
+def _open_dump(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise RuntimeError("Reading .zst dumps needs the zstandard package") from e
+        # Pushshift dumps are compressed with a long window
+        reader = zstandard.ZstdDecompressor(max_window_size=2 ** 31).stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def _parse_item(item, subreddits, is_review_text):
+    """
+    ('submission' | 'comment', row) for one dump object, or None if it is
+    filtered out.
+    """
+    subreddit = (item.get("subreddit") or "").lower()
+    if not subreddit or (subreddits and subreddit not in subreddits):
+        return None
+    author = item.get("author")
+    if author == "[deleted]":
+        author = None
+    if "body" in item:
+        body = item["body"]
+        if body in ("[deleted]", "[removed]") or not is_review_text(body):
+            return None
+        submission_id = (item.get("link_id") or "").split("_", 1)[-1]
+        return "comment", (item["id"], submission_id, subreddit, body, author,
+                           item.get("score"), float(item.get("created_utc") or 0))
+    if "title" in item:
+        selftext = item.get("selftext") or ""
+        if selftext in ("[deleted]", "[removed]"):
+            selftext = ""
+        return "submission", (item["id"], subreddit, item["title"], selftext, float(item.get("created_utc") or 0))
+    return None
+
+
+def _flush(conn, submissions, comments):
+    conn.executemany(
+        "INSERT OR IGNORE INTO reddit_submissions (id, subreddit, title, selftext, created_utc) VALUES (?, ?, ?, ?, ?)",
+        submissions
+    )
+    conn.executemany(
+        """INSERT OR IGNORE INTO reddit_comments (id, submission_id, subreddit, body, author, score, created_utc)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        comments
+    )
+    conn.commit()
+    submissions.clear()
+    comments.clear()
+
+
+def ingest(paths, subreddits=None, path=None):
+    """
+    Loads dump files into the index, keeping only `subreddits` if given.
+    Returns {'submissions': n, 'comments': n, 'skipped': n} for the lines read.
+    """
+    from utils.scraping_utils import is_review_text  # The scraper imports this module
+
+    subreddits = {name.lower() for name in subreddits or ()}
+    conn = get_connection(path)
+    counts = {'submissions': 0, 'comments': 0, 'skipped': 0}
+    submissions, comments = [], []
+    for dump_path in paths:
+        logger.info("Ingesting %s", dump_path)
+        with _open_dump(dump_path) as f:
+            for line in f:
+                try:
+                    parsed = _parse_item(json.loads(line), subreddits, is_review_text)
+                except (ValueError, KeyError, TypeError):
+                    parsed = None  # Malformed line
+                if parsed is None:
+                    counts['skipped'] += 1
+                    continue
+                kind, row = parsed
+                (submissions if kind == "submission" else comments).append(row)
+                counts[kind + 's'] += 1
+                if len(submissions) + len(comments) >= INGEST_BATCH_SIZE:
+                    _flush(conn, submissions, comments)
+    _flush(conn, submissions, comments)
+    conn.execute("INSERT INTO reddit_submissions_fts (reddit_submissions_fts) VALUES ('optimize')")
+    conn.commit()
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dumps", nargs="+", help="Submission and/or comment dump files")
+    parser.add_argument("--subreddit", action="append", help="Only keep this subreddit (repeatable)")
+    parser.add_argument("--index", default=REDDIT_INDEX_PATH, help="Index database file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    start = time.perf_counter()
+    counts = ingest(args.dumps, args.subreddit, path=args.index)
+    logger.info("Indexed %d submissions and %d review comments (%d lines skipped) in %.1fs",
+                counts['submissions'], counts['comments'], counts['skipped'], time.perf_counter() - start)
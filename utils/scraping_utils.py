@@ -1,22 +1,96 @@
 # utils/scraping_utils.py (Limit Reddit Reviews)
 import praw
+from praw.models import MoreComments
 import os
 from dotenv import load_dotenv
 import time
-import re
+import queue
+import logging
+import threading
+import concurrent.futures
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from utils.rate_limit_utils import TokenBucket
+from utils.deadline_utils import time_left, expired
+from utils.metrics_utils import timed, record_cache, record_upstream_call
+from utils.singleflight_utils import single_flight
+from utils import reddit_index_utils
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
-def scrape_reddit_reviews(place_name, place_address):
-    """
-    Scrapes Reddit comments for reviews, limited to 5 reviews.
-    """
-    reddit = praw.Reddit(
+MAX_REVIEWS = 5  # Limit overall reviews
+MAX_COMMENTS_PER_SUBMISSION = 5  # Limit comments per submission
+MAX_SUBMISSIONS = 5  # Limit submissions per subreddit
+REVIEW_KEYWORDS = ["visited", "recommend", "experience", "good", "bad", "review"]
+MIN_REVIEW_WORDS = 5
+
+# PRAW instances are not thread-safe, so each concurrent search checks one out
+# of a small pool instead of building a new client (and HTTP session) per call.
+REDDIT_POOL_SIZE = int(os.environ.get("REDDIT_POOL_SIZE", "4"))
+# Reddit allows ~100 OAuth requests per minute per client id; every pooled
+# client draws from this one budget.
+REDDIT_REQUESTS_PER_SECOND = float(os.environ.get("REDDIT_REQUESTS_PER_SECOND", "1.5"))
+REDDIT_BURST = int(os.environ.get("REDDIT_BURST", "10"))
+# Where reviews come from: "live" searches Reddit; "index" answers from the
+# local full-text index (utils/reddit_index_utils.py) and searches live only
+# when the index has nothing for the place; "index_only" never goes live.
+REDDIT_SOURCES = ("live", "index", "index_only")
+REDDIT_SOURCE = os.environ.get("REDDIT_SOURCE", "live").lower()
+if REDDIT_SOURCE not in REDDIT_SOURCES:
+    raise ValueError(f"REDDIT_SOURCE must be one of {', '.join(REDDIT_SOURCES)}, got {REDDIT_SOURCE!r}")
+
+reddit_rate_limiter = TokenBucket(REDDIT_REQUESTS_PER_SECOND, REDDIT_BURST)
+_client_pool = queue.Queue()
+_clients_created = 0
+_pool_lock = threading.Lock()
+_search_pool = ThreadPoolExecutor(max_workers=REDDIT_POOL_SIZE, thread_name_prefix="reddit")
+
+
+def _new_reddit_client():
+    return praw.Reddit(
         client_id=os.environ.get("REDDIT_CLIENT_ID"),
         client_secret=os.environ.get("REDDIT_CLIENT_SECRET"),
         user_agent=os.environ.get("REDDIT_USER_AGENT"),
     )
 
+
+@contextmanager
+def reddit_client():
+    """
+    Checks a praw.Reddit instance out of the process-wide pool, creating one
+    if the pool is not full yet.
+    """
+    global _clients_created
+    try:
+        client = _client_pool.get_nowait()
+    except queue.Empty:
+        with _pool_lock:
+            create = _clients_created < REDDIT_POOL_SIZE
+            if create:
+                _clients_created += 1
+        client = _new_reddit_client() if create else _client_pool.get()
+    try:
+        yield client
+    finally:
+        _client_pool.put(client)
+
+
+def is_review_text(text):
+    """
+    True if a comment looks like a review: mentions a review keyword and is
+    more than a few words long.
+    """
+    if not text:
+        return False
+    lowered = text.lower()
+    return any(keyword in lowered for keyword in REVIEW_KEYWORDS) and len(text.split()) > MIN_REVIEW_WORDS
+
+
+def subreddits_for_place(place_name, place_address):
+    """
+    Picks the subreddits worth searching for a place.
+    """
     address_parts = place_address.split(',')
     city = ""
     if len(address_parts) > 1:
@@ -35,41 +109,122 @@ def scrape_reddit_reviews(place_name, place_address):
     if "park" in place_name.lower():
         subreddits_to_search.extend(["parks", "outdoors"])
 
-    subreddits_to_search = list(set(subreddits_to_search))
+    return list(dict.fromkeys(subreddits_to_search))  # Dedupe, keep order
+
+
+def _iter_comments(submission):
+    """
+    Yields a submission's loaded comments breadth-first, lazily, skipping
+    "load more" stubs instead of expanding and flattening the whole tree.
+    """
+    pending = list(submission.comments)
+    while pending:
+        comment = pending.pop(0)
+        if isinstance(comment, MoreComments):
+            continue
+        yield comment
+        pending.extend(comment.replies)
+
+
+class _Counter:
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def add(self):
+        with self._lock:
+            self._value += 1
+            return self._value
+
 
+def _search_subreddit(subreddit_name, place_name, found, done, deadline=None):
+    """
+    Collects review comments for one subreddit. `found` counts reviews across
+    every concurrent search; `done` is set once the overall quota is met (or
+    the deadline passes) so the other searches stop fetching.
+    """
     reviews = []
     try:
-        for subreddit_name in subreddits_to_search:
-            try:
-                subreddit = reddit.subreddit(subreddit_name)
-                search_query = f'"{place_name}"'
-                for submission in subreddit.search(search_query, limit=5): # Limit submissions
-                    submission.comments.replace_more(limit=0)
-                    comment_count = 0 # Limit comments per submission
-                    for comment in submission.comments.list():
-                        if any(keyword in comment.body.lower() for keyword in ["visited", "recommend", "experience", "good", "bad", "review"]):
-                            if len(comment.body.split()) > 5:
-                                reviews.append({
-                                    'source': f'Reddit (r/{subreddit_name})',
-                                    'text': comment.body,
-                                    'rating': None,
-                                    'date': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(comment.created_utc)),
-                                    'user': str(comment.author) if comment.author else "[deleted]",
-                                })
-                                comment_count += 1
-                                if comment_count >= 5:  # Limit comments per submission
-                                    break
-                        if len(reviews) >= 5: # Limit overall reviews
+        with reddit_client() as reddit:
+            if done.is_set():
+                return reviews
+            if not reddit_rate_limiter.acquire(timeout=time_left(deadline)):  # Search request
+                return reviews
+            record_upstream_call("reddit", "search")
+            subreddit = reddit.subreddit(subreddit_name)
+            search_query = f'"{place_name}"'
+            for submission in subreddit.search(search_query, limit=MAX_SUBMISSIONS): # Limit submissions
+                if done.is_set():
+                    break
+                if not reddit_rate_limiter.acquire(timeout=time_left(deadline)):  # Comment tree fetch
+                    break
+                record_upstream_call("reddit", "comments")
+                comment_count = 0 # Limit comments per submission
+                for comment in _iter_comments(submission):
+                    if is_review_text(comment.body):
+                        reviews.append({
+                            'source': f'Reddit (r/{subreddit_name})',
+                            'text': comment.body,
+                            'rating': None,
+                            'date': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(comment.created_utc)),
+                            'user': str(comment.author) if comment.author else "[deleted]",
+                        })
+                        comment_count += 1
+                        if found.add() >= MAX_REVIEWS:
+                            done.set()
+                        if comment_count >= MAX_COMMENTS_PER_SUBMISSION or done.is_set():
                             break
-                    if len(reviews) >=5:
-                        break
+    except Exception as e:
+        logger.error("Error accessing subreddit r/%s: %s - %s", subreddit_name, type(e).__name__, e)
+    return reviews
+
 
-            except Exception as e:
-                print(f"Error accessing subreddit r/{subreddit_name}: {type(e).__name__} - {e}")
+@timed("reddit")
+@single_flight("reddit", key=lambda place_name, place_address, deadline=None: (place_name, place_address),
+               late_result=list)
+def scrape_reddit_reviews(place_name, place_address, deadline=None):
+    """
+    Scrapes Reddit comments for reviews, limited to 5 reviews.
+
+    Subreddits are searched concurrently with pooled clients under a shared
+    rate budget, and every search stops as soon as the quota is met. With a
+    `deadline` (time.monotonic()), whatever was found by then is returned.
+    Concurrent searches for the same place share one scrape.
+
+    With REDDIT_SOURCE=index the local index is tried first (see
+    REDDIT_SOURCES).
+    """
+    subreddits_to_search = subreddits_for_place(place_name, place_address)
+
+    if REDDIT_SOURCE != "live":
+        reviews = reddit_index_utils.search_reviews(place_name, subreddits_to_search, MAX_SUBMISSIONS,
+                                                    MAX_COMMENTS_PER_SUBMISSION, MAX_REVIEWS)
+        record_cache("reddit_index", hit=bool(reviews))
+        if reviews or REDDIT_SOURCE == "index_only":
+            return reviews
+
+    found = _Counter()
+    done = threading.Event()
+    reviews = []
+    try:
+        futures = [
+            _search_pool.submit(_search_subreddit, subreddit_name, place_name, found, done, deadline)
+            for subreddit_name in subreddits_to_search
+        ]
+        # Merge in subreddit order so results don't depend on thread timing.
+        # Once the quota is met the other searches stop quickly, so wait for
+        # them; only the deadline cuts them off.
+        for future in futures:
+            if expired(deadline) and not future.done():
+                future.cancel()  # Not started yet, or still running past the deadline
                 continue
-            if len(reviews) >= 5:
-                break
+            try:
+                reviews.extend(future.result(timeout=time_left(deadline)))
+            except concurrent.futures.TimeoutError:
+                logger.info("Reddit search for %s hit its deadline", place_name)
+                done.set()  # Stop the searches still running
     except Exception as e:
-        print("Error: ", e)
+        logger.error("Error scraping Reddit for %s: %s: %s", place_name, type(e).__name__, e)
+
+    return reviews[:MAX_REVIEWS]
 
-    return reviews
\ No newline at end of file
@@ -0,0 +1,106 @@
+# utils/singleflight_utils.py
+import os
+import time
+import logging
+import functools
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from utils.deadline_utils import time_left, expired
+from utils.metrics_utils import inc, COALESCED_CALLS
+
+logger = logging.getLogger(__name__)
+
+# How long callers wait on someone else's call before giving up on it and
+# making their own. Also how long a stuck call keeps its key.
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get("SINGLE_FLIGHT_TIMEOUT", "30"))
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller (the
+    leader) runs the call, and callers arriving while it is in flight wait
+    for its result instead of repeating it. An exception raised by the call
+    is raised in every waiter too. Results are shared, so callers must not
+    mutate them.
+
+    A waiter gives up after `timeout` seconds (or at its own `deadline`),
+    and a call in flight for longer than `timeout` no longer holds its key:
+    the next caller starts a fresh call instead of queueing behind it. A
+    waiter whose deadline has passed does not make its own call: it returns
+    late_result() (None by default), as the call itself would have been cut
+    off with nothing.
+    """
+
+    def __init__(self, name, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self._flights = {}  # key -> (started, Future)
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, deadline=None, timeout=None, late_result=None, **kwargs):
+        """
+        Returns func(*args, **kwargs), sharing the result with concurrent
+        calls for the same key. `timeout` overrides the per-key timeout for
+        this call; `late_result` makes the result for a waiter past its
+        deadline.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        now = time.monotonic()
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None or now - flight[0] >= timeout
+            if leader:
+                flight = self._flights[key] = (now, Future())
+        started, future = flight
+
+        if leader:
+            inc(COALESCED_CALLS, function=self.name, role="leader")
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+            return future.result()
+
+        wait = max(started + timeout - now, 0.0)
+        if deadline is not None:
+            wait = min(wait, time_left(deadline))
+        try:
+            result = future.result(timeout=wait)
+        except FutureTimeoutError:
+            if expired(deadline):
+                # Too late to make our own call; repeating it is what we are here to prevent
+                inc(COALESCED_CALLS, function=self.name, role="late")
+                return late_result() if late_result else None
+            # The shared call is too slow for us: make our own
+            inc(COALESCED_CALLS, function=self.name, role="timeout")
+            logger.info("%s call for %r still in flight after %.1fs, calling directly", self.name, key, wait)
+            return func(*args, **kwargs)
+        inc(COALESCED_CALLS, function=self.name, role="waiter")
+        return result
+
+
+def single_flight(name, key, timeout=SINGLE_FLIGHT_TIMEOUT, late_result=None):
+    """
+    Decorator form of SingleFlight. `key` is called with the function's
+    arguments and returns the coalescing key, or None to call straight
+    through. A `deadline` keyword argument bounds how long a waiter waits;
+    once it has passed, the waiter returns late_result() instead.
+    """
+    def decorator(func):
+        flights = SingleFlight(name, timeout)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            call_key = key(*args, **kwargs)
+            if call_key is None:
+                return func(*args, **kwargs)
+            return flights.do(call_key, functools.partial(func, *args, **kwargs), deadline=kwargs.get('deadline'),
+                              late_result=late_result)
+
+        wrapper.flights = flights
+        return wrapper
+    return decorator
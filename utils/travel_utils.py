@@ -1,11 +1,29 @@
 # utils/travel_utils.py
 import googlemaps
 import os
+import math
+import logging
 from dotenv import load_dotenv
+from utils.cache_utils import LRUCache
+from utils.metrics_utils import timed, record_upstream_call
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 gmaps = googlemaps.Client(key=os.environ.get("GOOGLE_MAPS_API_KEY"))
 
+# Pairs closer than this (straight line) are clearly walkable, so we estimate
+# them locally instead of asking the Distance Matrix API.
+WALKABLE_METERS = float(os.environ.get("TRAVEL_WALKABLE_METERS", "800"))
+WALKING_METERS_PER_MINUTE = 80  # ~3 mph
+# Coordinates are rounded to ~11 m before caching, so repeat plans hit.
+TRAVEL_COORD_PRECISION = 4
+TRAVEL_CACHE_TTL = int(os.environ.get("TRAVEL_CACHE_TTL", 6 * 3600))
+_travel_cache = LRUCache(maxsize=5000, ttl=TRAVEL_CACHE_TTL, name="travel")
+# Distance Matrix limits per request; larger plans are split into blocks
+MAX_MATRIX_ORIGINS = 25
+MAX_MATRIX_DESTINATIONS = 25
+MAX_MATRIX_ELEMENTS = 100
+
 def get_travel_info(origin_lat, origin_lon, dest_lat, dest_lon):
     """
     Gets travel time and distance between two locations using the Distance Matrix API.
@@ -30,9 +48,129 @@ def get_travel_info(origin_lat, origin_lon, dest_lat, dest_lon):
             duration = result['rows'][0]['elements'][0]['duration']['text']
             return {'distance': distance, 'duration': duration}
         else:
-            print(f"Distance Matrix API error: {result['status']}")
+            logger.error("Distance Matrix API error: %s", result['status'])
             return None
 
     except Exception as e:
-        print(f"Error in get_travel_info: {type(e).__name__}: {e}")
-        return None
\ No newline at end of file
+        logger.error("Error in get_travel_info: %s: %s", type(e).__name__, e)
+        return None
+
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points, in meters."""
+    radius = 6371000
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = math.radians(lat2 - lat1)
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * radius * math.asin(math.sqrt(a))
+
+
+def _walking_estimate(meters):
+    miles = meters / 1609.344
+    minutes = max(1, int(round(meters / WALKING_METERS_PER_MINUTE)))
+    return {
+        'distance': f"{miles:.1f} mi",
+        'duration': f"{minutes} min{'s' if minutes != 1 else ''}",
+        'mode': 'walking',
+        'estimated': True
+    }
+
+
+def _cache_key(origin, destination, mode):
+    return (
+        round(origin[0], TRAVEL_COORD_PRECISION), round(origin[1], TRAVEL_COORD_PRECISION),
+        round(destination[0], TRAVEL_COORD_PRECISION), round(destination[1], TRAVEL_COORD_PRECISION),
+        mode
+    )
+
+
+@timed("travel")
+def get_travel_matrix(locations, mode="driving"):
+    """
+    Gets travel time and distance between every pair of locations.
+
+    Cached pairs and clearly walkable pairs (haversine distance under
+    WALKABLE_METERS) are answered locally; everything else goes to the
+    Distance Matrix API, in as few requests as its per-request limits allow.
+
+    Args:
+        locations: A list of (latitude, longitude) tuples.
+        mode: Travel mode for the API ("driving", "walking", "bicycling", "transit").
+    Returns:
+        An N x N list of lists. matrix[i][j] is a dictionary with 'distance'
+        (text), 'duration' (text) and 'mode', or None on the diagonal / on error.
+    """
+    n = len(locations)
+    matrix = [[None] * n for _ in range(n)]
+    needed = []  # (i, j) pairs we have to ask the API for
+
+    for i in range(n):
+        for j in range(n):
+            if i == j:
+                continue
+            cached = _travel_cache.get(_cache_key(locations[i], locations[j], mode))
+            if cached is not None:
+                matrix[i][j] = cached
+                continue
+            meters = haversine_meters(locations[i][0], locations[i][1], locations[j][0], locations[j][1])
+            if meters < WALKABLE_METERS:
+                matrix[i][j] = _walking_estimate(meters)
+                continue
+            needed.append((i, j))
+
+    if not needed:
+        return matrix
+
+    origin_indexes = sorted({i for i, _ in needed})
+    destination_indexes = sorted({j for _, j in needed})
+    needed = set(needed)
+    origin_block = min(len(origin_indexes), MAX_MATRIX_ORIGINS)
+    destination_block = min(MAX_MATRIX_DESTINATIONS, MAX_MATRIX_ELEMENTS // origin_block)
+    for o in range(0, len(origin_indexes), origin_block):
+        origins = origin_indexes[o:o + origin_block]
+        for d in range(0, len(destination_indexes), destination_block):
+            destinations = destination_indexes[d:d + destination_block]
+            if any((i, j) in needed for i in origins for j in destinations):
+                _fill_matrix_block(matrix, locations, origins, destinations, mode)
+
+    return matrix
+
+
+def _fill_matrix_block(matrix, locations, origin_indexes, destination_indexes, mode):
+    """
+    Asks the Distance Matrix API for one block of origins x destinations
+    (within the per-request limits) and fills and caches its legs.
+    """
+    try:
+        record_upstream_call("gmaps", "distance_matrix")
+        result = gmaps.distance_matrix(
+            origins=[{"latitude": locations[i][0], "longitude": locations[i][1]} for i in origin_indexes],
+            destinations=[{"latitude": locations[j][0], "longitude": locations[j][1]} for j in destination_indexes],
+            mode=mode,
+            units="imperial" # or "metric"
+        )
+
+        if result['status'] != 'OK':
+            logger.error("Distance Matrix API error: %s", result['status'])
+            return
+
+        for row_number, i in enumerate(origin_indexes):
+            elements = result['rows'][row_number]['elements']
+            for column_number, j in enumerate(destination_indexes):
+                if i == j:
+                    continue
+                element = elements[column_number]
+                if element['status'] != 'OK':
+                    continue
+                leg = {
+                    'distance': element['distance']['text'],
+                    'duration': element['duration']['text'],
+                    'mode': mode
+                }
+                _travel_cache.set(_cache_key(locations[i], locations[j], mode), leg)
+                if matrix[i][j] is None:
+                    matrix[i][j] = leg
+
+    except Exception as e:
+        logger.error("Error in get_travel_matrix: %s: %s", type(e).__name__, e)
@@ -1,16 +1,93 @@
 # utils/weather_utils.py
 import os
+import time
+import logging
+import threading
 from datetime import datetime, timedelta
 from pyowm.owm import OWM
 from dotenv import load_dotenv
+from utils.metrics_utils import timed, record_cache, record_upstream_call
+from utils.singleflight_utils import SingleFlight
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 OPENWEATHERMAP_API_KEY = os.environ.get("OPENWEATHERMAP_API_KEY")
 
+# Forecasts are cached per coarse grid cell: places within the same cell
+# (0.1 degree is roughly 11 km) share one One Call fetch.
+WEATHER_CELL_DEGREES = float(os.environ.get("WEATHER_CELL_DEGREES", "0.1"))
+# OpenWeatherMap refreshes its forecast models about once an hour, so cached
+# entries expire at the next refresh boundary rather than after a fixed age.
+WEATHER_REFRESH_SECONDS = int(os.environ.get("WEATHER_REFRESH_SECONDS", "3600"))
+
+_owm = None
+_weather_manager = None
+_client_lock = threading.Lock()
+
+_forecast_cache = {}  # cell key -> (expires_at, weather_data)
+_cache_lock = threading.Lock()
+_cell_flights = SingleFlight("weather")  # Concurrent lookups in one cell fetch once
+
+
+def get_weather_manager():
+    """
+    Returns the process-wide pyowm weather manager, creating it on first use.
+    """
+    global _owm, _weather_manager
+    if _weather_manager is None:
+        with _client_lock:
+            if _weather_manager is None:
+                _owm = OWM(OPENWEATHERMAP_API_KEY)
+                _weather_manager = _owm.weather_manager()
+    return _weather_manager
+
+
+def weather_cell(latitude, longitude):
+    """
+    Snaps coordinates to the forecast grid cell they fall in.
+    """
+    lat_cell = round(round(latitude / WEATHER_CELL_DEGREES) * WEATHER_CELL_DEGREES, 4)
+    lon_cell = round(round(longitude / WEATHER_CELL_DEGREES) * WEATHER_CELL_DEGREES, 4)
+    return lat_cell, lon_cell
+
+
+def _next_refresh(now):
+    return (int(now) // WEATHER_REFRESH_SECONDS + 1) * WEATHER_REFRESH_SECONDS
+
+
+def weekend_dates(today=None):
+    """
+    Returns the dates of the next Saturday and Sunday as 'YYYY-MM-DD' strings.
+    """
+    today = today or datetime.now()
+    days_until_saturday = (5 - today.weekday()) % 7  # Saturday is 5 (Monday is 0)
+    days_until_sunday = (6 - today.weekday()) % 7
+
+    saturday = today + timedelta(days=days_until_saturday)
+    sunday = today + timedelta(days=days_until_sunday)
+    return saturday.strftime('%Y-%m-%d'), sunday.strftime('%Y-%m-%d')  # Format as YYYY-MM-DD
+
+
+def weekend_window_end(now=None):
+    """
+    Unix time of the next local midnight at which weekend_dates() changes,
+    i.e. when anything computed for the current weekend goes out of date.
+    """
+    now = now or datetime.now()
+    current = weekend_dates(now)
+    midnight = datetime(now.year, now.month, now.day) + timedelta(days=1)
+    while weekend_dates(midnight) == current:
+        midnight += timedelta(days=1)
+    return midnight.timestamp()
+
+@timed("weather")
 def get_weekend_weather(latitude, longitude):
     """
     Gets the weather forecast for the upcoming Saturday and Sunday.
 
+    Forecasts are shared by every place in the same coarse grid cell and
+    cached until the provider's next forecast refresh.
+
     Args:
         latitude: The latitude of the location.
         longitude: The longitude of the location.
@@ -24,29 +101,64 @@ def get_weekend_weather(latitude, longitude):
         }
     """
     if not OPENWEATHERMAP_API_KEY:
-        print("Error: OPENWEATHERMAP_API_KEY not set in environment variables.")
+        logger.error("OPENWEATHERMAP_API_KEY not set in environment variables.")
         return None
 
-    try:
-        owm = OWM(OPENWEATHERMAP_API_KEY)
-        mgr = owm.weather_manager()
+    saturday_str, sunday_str = weekend_dates()
+    cell = weather_cell(latitude, longitude)
+    key = (cell, saturday_str, sunday_str)
+
+    cached = _get_cached_forecast(key)
+    if cached is not None:
+        record_cache("weather", hit=True)
+        return cached
+    record_cache("weather", hit=False)
+    return _cell_flights.do(key, _fetch_and_cache, key)
 
-        # --- 1. Find the next Saturday and Sunday ---
-        today = datetime.now()
-        days_until_saturday = (5 - today.weekday()) % 7  # Saturday is 5 (Monday is 0)
-        days_until_sunday = (6 - today.weekday()) % 7
 
-        saturday = today + timedelta(days=days_until_saturday)
-        sunday = today + timedelta(days=days_until_sunday)
-        saturday_str = saturday.strftime('%Y-%m-%d')  # Format as YYYY-MM-DD
-        sunday_str = sunday.strftime('%Y-%m-%d')
+def _fetch_and_cache(key):
+    # A leader may have cached it between our cache miss and taking the flight
+    cached = _get_cached_forecast(key)
+    if cached is not None:
+        return cached
+    (latitude, longitude), saturday_str, sunday_str = key
+    weather_data = _fetch_weekend_weather(latitude, longitude, saturday_str, sunday_str)
+    if weather_data is not None:
+        now = time.time()
+        with _cache_lock:
+            # Drop expired cells (e.g. last weekend's) while we hold the lock
+            for old_key in [k for k, (expires_at, _) in _forecast_cache.items() if now >= expires_at]:
+                del _forecast_cache[old_key]
+            _forecast_cache[key] = (_next_refresh(now), weather_data)
+    return weather_data
+
+
+def _get_cached_forecast(key):
+    with _cache_lock:
+        entry = _forecast_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, weather_data = entry
+        if time.time() >= expires_at:
+            del _forecast_cache[key]
+            return None
+        return weather_data
+
+
+def _fetch_weekend_weather(latitude, longitude, saturday_str, sunday_str):
+    """
+    Calls One Call for the given coordinates and extracts the weekend days.
+    """
+    try:
+        mgr = get_weather_manager()
 
-        # --- 2. Get the forecast ---
+        # --- Get the forecast ---
         # Use one_call for daily forecast (more reliable for specific dates)
+        record_upstream_call("openweathermap", "one_call")
         one_call = mgr.one_call(lat=latitude, lon=longitude)
         daily_forecast = one_call.forecast_daily
 
-        # --- 3. Extract Relevant Data ---
+        # --- Extract Relevant Data ---
         weather_data = {}
         for forecast in daily_forecast:
             forecast_date = datetime.fromtimestamp(forecast.reference_time('unix')).strftime('%Y-%m-%d')
@@ -67,7 +179,7 @@ def get_weekend_weather(latitude, longitude):
         return weather_data
 
     except Exception as e:
-        print(f"Error getting weather: {type(e).__name__}: {e}")
+        logger.error("Error getting weather: %s: %s", type(e).__name__, e)
         return None
 
 
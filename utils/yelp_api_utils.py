@@ -1,46 +1,78 @@
 # utils/yelp_api_utils.py
 import os
+import logging
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from urllib.parse import urlencode
-import time
+from utils.cache_utils import LRUCache
+from utils.metrics_utils import timed, record_upstream_call
+from utils.deadline_utils import time_left
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 YELP_API_KEY = os.environ.get("YELP_API_KEY")
 BASE_URL = "https://api.yelp.com/v3"
+YELP_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+YELP_POOL_SIZE = int(os.environ.get("YELP_POOL_SIZE", "16"))
 
+# One keep-alive session for every Yelp call, sized for concurrent entities
+session = requests.Session()
+session.headers.update({"Authorization": f"Bearer {YELP_API_KEY}"})
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=YELP_POOL_SIZE))
 
-def _yelp_api_request(endpoint, params=None):
+# place -> Yelp business id (or NO_MATCH), so repeat places skip Business Match
+YELP_MATCH_TTL = int(os.environ.get("YELP_MATCH_TTL", 7 * 24 * 3600))
+YELP_NO_MATCH_TTL = int(os.environ.get("YELP_NO_MATCH_TTL", 24 * 3600))
+NO_MATCH = ""
+_match_cache = LRUCache(maxsize=5000, ttl=YELP_MATCH_TTL, name="yelp_match")
+
+
+def _yelp_api_request(endpoint, params=None, deadline=None):
     """
-    Makes an authenticated request to the Yelp Fusion API.
+    Makes an authenticated request to the Yelp Fusion API. Returns None
+    without calling if `deadline` has passed; the read timeout never runs
+    past it.
     """
     url = BASE_URL + endpoint
-    headers = {
-        "Authorization": f"Bearer {YELP_API_KEY}",
-    }
     if params:
         url += "?" + urlencode(params)
+    # Read the time left once: checking expired() first could still leave a
+    # zero read timeout, which requests rejects with a ValueError
+    remaining = time_left(deadline)
+    if remaining is not None and remaining <= 0:
+        return None
+    timeout = YELP_TIMEOUT if remaining is None else (YELP_TIMEOUT[0], min(YELP_TIMEOUT[1], remaining))
 
     try:
-        response = requests.get(url, headers=headers)
+        record_upstream_call("yelp", endpoint.rsplit("/", 1)[-1])  # "matches" / "reviews"
+        response = session.get(url, timeout=timeout)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
-        print(f"Yelp API request error: {e}")
-        print(f"  URL: {url}")
+        logger.error("Yelp API request error: %s (URL: %s)", e, url)
         return None
     except ValueError as e:
-        print(f"Error decoding Yelp API response as JSON: {e}")
+        logger.error("Error decoding Yelp API response as JSON: %s", e)
         return None
 
 
-def get_yelp_reviews(place_name, place_address, latitude, longitude):
-    """Retrieves Yelp reviews using the Yelp Fusion API (Business Match)."""
+def _match_cache_key(place_name, place_address, latitude, longitude, place_id=None):
+    if place_id:
+        return place_id
+    return (place_name, place_address, round(float(latitude), 4), round(float(longitude), 4))
 
-    if not all([place_name, place_address, latitude, longitude]):
-        print("Missing required parameters for Yelp Business Match.")
-        return []
+
+def match_yelp_business(place_name, place_address, latitude, longitude, place_id=None, deadline=None):
+    """
+    Finds the Yelp business id for a place with Business Match, caching the
+    answer (including "not on Yelp") per place. Returns the id or None.
+    """
+    cache_key = _match_cache_key(place_name, place_address, latitude, longitude, place_id)
+    cached = _match_cache.get(cache_key)
+    if cached is not None:
+        return cached or None
 
     address_parts = place_address.split(',')
     street = ""
@@ -79,30 +111,47 @@ def get_yelp_reviews(place_name, place_address, latitude, longitude):
     # Clean up empty parameters to prevent errors
     filtered_match_params = {k: v for k, v in match_params.items() if v}
 
-    match_results = _yelp_api_request("/businesses/matches", params=filtered_match_params)
+    match_results = _yelp_api_request("/businesses/matches", params=filtered_match_params, deadline=deadline)
 
-    if not match_results or 'businesses' not in match_results or not match_results['businesses']:
-        print("Business not found on Yelp via Business Match.")
-        return []
+    if match_results is None:  # API error: don't cache, it may be transient
+        return None
+    if 'businesses' not in match_results or not match_results['businesses']:
+        logger.debug("Business not found on Yelp via Business Match.")
+        _match_cache.set(cache_key, NO_MATCH, ttl=YELP_NO_MATCH_TTL)
+        return None
 
     business_id = match_results['businesses'][0]['id']
+    _match_cache.set(cache_key, business_id)
+    return business_id
+
+
+@timed("yelp")
+def get_yelp_reviews(place_name, place_address, latitude, longitude, place_id=None, deadline=None):
+    """
+    Retrieves Yelp reviews using the Yelp Fusion API (Business Match).
+    Returns [] once `deadline` (time.monotonic()) has passed.
+    """
 
-    # --- 2. Check Business Details (Optional, but good for debugging) ---
-    business_details = _yelp_api_request(f"/businesses/{business_id}")
-    if not business_details:
-        print(f"Could not retrieve details for business ID: {business_id}")
+    if not YELP_API_KEY:
         return []
-    #print(f"DEBUG: Business Details: {business_details}")  # Uncomment to see details
 
+    if not all([place_name, place_address, latitude, longitude]):
+        logger.debug("Missing required parameters for Yelp Business Match.")
+        return []
+
+    # --- 1. Business Match (cached per place) ---
+    business_id = match_yelp_business(place_name, place_address, latitude, longitude, place_id, deadline)
+    if not business_id:
+        return []
 
-    # --- 3. Get Reviews (Handle 404 Specifically) ---
-    review_results = _yelp_api_request(f"/businesses/{business_id}/reviews")
+    # --- 2. Get Reviews (Handle 404 Specifically) ---
+    review_results = _yelp_api_request(f"/businesses/{business_id}/reviews", deadline=deadline)
 
     if review_results is None:  # General API error (already handled)
         return []
     #We handle the case where no reviews are available
     if 'error' in review_results and review_results['error']['code'] == 'NOT_FOUND':
-        print(f"No reviews found for business ID: {business_id} (Yelp API 404)")
+        logger.info("No reviews found for business ID: %s (Yelp API 404)", business_id)
         return []
     elif 'reviews' in review_results:
         reviews = []
@@ -114,11 +163,10 @@ def get_yelp_reviews(place_name, place_address, latitude, longitude):
                 'date': review['time_created'],
                 'user': review['user']['name'] if review.get('user') and review['user'].get('name') else None,
             }
-            #print(f"DEBUG: Processed Yelp review: {review_data}")  # Keep for debugging if needed
             reviews.append(review_data)
         return reviews
     else: #Handles other errors, like a malformed request.
-        print(f"Unexpected response from Yelp reviews endpoint: {review_results}")
+        logger.warning("Unexpected response from Yelp reviews endpoint: %s", review_results)
         return[]
 
 if __name__ == '__main__':